@@ -4,6 +4,15 @@ Note that solved configuration has the blank (zero) tile in upper left
 Use the arrows key to swap this tile with its neighbors
 """
 
+import json
+import mmap
+import multiprocessing
+import random
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
 import poc_fifteen_gui
 
 #for m * n grid
@@ -13,11 +22,371 @@ MOVE = {'left' : ('ulldr','dllur'),
         'down': ('lddru', 'rddlu')
         }
 
-class Puzzle:
+# solver modes accepted by Puzzle.solve_puzzle
+PHASE = "phase"
+OPTIMAL = "optimal"
+BIDIRECTIONAL = "bidirectional"
+
+# search budget for the optimal solvers, past which they
+# fall back to the phase solver
+IDA_NODE_LIMIT = 2000000
+IDA_TIME_LIMIT = 30.0
+
+# blank offsets for each move and the move that undoes it
+OFFSETS = {'u': (-1, 0), 'd': (1, 0), 'l': (0, -1), 'r': (0, 1)}
+INVERSE = {'u': 'd', 'd': 'u', 'l': 'r', 'r': 'l', None: None}
+
+# steps of the phase solver, in solving order
+PHASES = ("start", "interior", "col0", "row0", "row1", "2x2")
+
+# search results that are not a new f-cost bound
+FOUND = -1
+ABORTED = -2
+
+# pattern database files: a header of magic, height, width and
+# number of patterns, then each pattern's tile list, then the
+# one byte per entry distance tables in pattern order
+PDB_MAGIC = "PDB1"
+PDB_HEADER = "<4sHHH"
+PDB_GROUP_SIZE = 5
+PDB_UNSEEN = 255
+
+# solved boards shared by the invariant checks, keyed by cell count
+SOLVED_CELLS = {}
+
+# compiled move strings keyed by (width, moves),
+# emptied whenever it grows past COMPILED_CACHE_SIZE entries
+COMPILED_MOVES = {}
+COMPILED_CACHE_SIZE = 1024
+
+# multipliers for the position hashes of shorten_moves
+HASH_BITS = 64
+HASH_SEED = 15
+
+# benchmark board sizes, from the 8 puzzle to large rectangles
+BENCHMARK_SIZES = ((3, 3), (4, 4), (5, 5), (4, 7), (8, 8), (10, 16),
+                   (20, 20), (30, 30), (25, 40))
+
+# batch solving: boards handed to a worker at a time, the header
+# of packed binary boards and each worker's mapped databases
+BATCH_CHUNK_SIZE = 16
+BOARD_HEADER = "<HH"
+WORKER_DATABASES = {}
+
+
+def line_conflict(goals):
+    """
+    Linear conflict penalty of a single row or column
+    goals lists, in board order, the goal offsets along the line
+    of the tiles whose goal position lies in that line
+    Returns an integer
+    """
+    # every tile outside a longest increasing run has to leave
+    # the line and come back, costing two extra moves
+    tails = []
+    for goal in goals:
+        index = bisect_left(tails, goal)
+        if index == len(tails):
+            tails.append(goal)
+        else:
+            tails[index] = goal
+    return 2 * (len(goals) - len(tails))
+
+def count_inversions(values):
+    """
+    Number of pairs of values that appear in decreasing order,
+    counted with a bottom-up merge sort in O(n log n)
+    Returns an integer
+    """
+    values = list(values)
+    length = len(values)
+    merged = [0] * length
+    inversions = 0
+    width = 1
+    while width < length:
+        for low in range(0, length - width, 2 * width):
+            middle = low + width
+            high = min(low + 2 * width, length)
+            left, right, out = low, middle, low
+            while left < middle and right < high:
+                if values[right] < values[left]:
+                    # the right value jumps every remaining left value
+                    inversions += middle - left
+                    merged[out] = values[right]
+                    right += 1
+                else:
+                    merged[out] = values[left]
+                    left += 1
+                out += 1
+            merged[out:high] = values[left:middle] + values[right:high]
+            values[low:high] = merged[low:high]
+        width *= 2
+    return inversions
+
+def cell_typecode(cells):
+    """
+    Smallest array typecode that holds every tile of a board
+    with the given number of cells
+    Returns a string
+    """
+    if cells <= 1 << 16:
+        return "H"
+    return "L"
+
+def solved_cells(cells):
+    """
+    Solved board with the given number of cells, shared between
+    puzzles of the same size and never modified
+    Returns an array of integers
+    """
+    if cells not in SOLVED_CELLS:
+        SOLVED_CELLS[cells] = array(cell_typecode(cells), range(cells))
+    return SOLVED_CELLS[cells]
+
+##################################################################
+# Pattern databases
+
+def default_partition(puzzle_height, puzzle_width, group_size=PDB_GROUP_SIZE):
+    """
+    Split the numbered tiles into disjoint row-major groups of
+    at most group_size tiles (5-5-5 for the 4 x 4 puzzle)
+    Returns a tuple of tuples of tile numbers
+    """
+    tiles = range(1, puzzle_height * puzzle_width)
+    return tuple(tuple(tiles[start:start + group_size])
+                 for start in range(0, len(tiles), group_size))
+
+def pattern_size(count, cells):
+    """
+    Number of ways to place count distinct tiles on cells cells
+    Returns an integer
+    """
+    size = 1
+    for index in range(count):
+        size *= cells - index
+    return size
+
+def pattern_rank(positions, cells):
+    """
+    Index of an arrangement of distinct cells between 0 and
+    pattern_size(len(positions), cells) - 1
+    Returns an integer
+    """
+    rank = 0
+    for index, position in enumerate(positions):
+        digit = position
+        for earlier in positions[:index]:
+            if earlier < position:
+                digit -= 1
+        rank = rank * (cells - index) + digit
+    return rank
+
+def blank_regions(neighbors, occupied):
+    """
+    Split the cells outside the occupied bit mask into the
+    regions the blank can move around in without crossing an
+    occupied cell
+    Returns a list giving each free cell the smallest cell of its
+    region (None for occupied cells) and a dictionary from those
+    smallest cells to the cells of their region
+    """
+    labels = [None] * len(neighbors)
+    members = {}
+    for start in range(len(neighbors)):
+        if occupied >> start & 1 or labels[start] != None:
+            continue
+        labels[start] = start
+        region = [start]
+        for cell in region:
+            for neighbor in neighbors[cell]:
+                if not occupied >> neighbor & 1 and labels[neighbor] == None:
+                    labels[neighbor] = start
+                    region.append(neighbor)
+        members[start] = region
+    return labels, members
+
+def build_pattern_database(puzzle_height, puzzle_width, tiles):
+    """
+    Retrograde breadth first search from the solved puzzle
+    counting only moves of the given tiles, so tables built for
+    disjoint tile groups can be added together
+    The table takes one byte and the search one bit per pattern
+    state for every cell, so groups of more than 6 tiles of the
+    4 x 4 puzzle (the 7-8 partition) do not fit in memory
+    Returns a bytearray indexed by pattern_rank of the tile cells
+    """
+    cells = puzzle_height * puzzle_width
+    size = pattern_size(len(tiles), cells)
+    table = bytearray([PDB_UNSEEN]) * size
+    neighbors = []
+    for cell in range(cells):
+        row, col = divmod(cell, puzzle_width)
+        neighbors.append([(row + drow) * puzzle_width + col + dcol
+                          for drow, dcol in OFFSETS.values()
+                          if 0 <= row + drow < puzzle_height and
+                          0 <= col + dcol < puzzle_width])
+
+    # moving the blank among the other tiles is free, so a state
+    # is the pattern cells plus the region the blank can reach,
+    # named by its smallest cell; regions only depend on the set
+    # of occupied cells and are cached by its bit mask
+    regions = {}
+    def labelled(occupied):
+        """
+        Cached blank_regions of an occupied bit mask
+        """
+        result = regions.get(occupied)
+        if result == None:
+            result = blank_regions(neighbors, occupied)
+            regions[occupied] = result
+        return result
+
+    # states are marked in a bitset when generated, so each one
+    # enters the frontier once
+    seen = bytearray((size * cells + 7) // 8)
+    start = tuple(tiles)
+    occupied = 0
+    for position in start:
+        occupied |= 1 << position
+    state = pattern_rank(start, cells) * cells + labelled(occupied)[0][0]
+    seen[state >> 3] |= 1 << (state & 7)
+    frontier = [(start, occupied, 0)]
+    depth = 0
+    while frontier:
+        next_frontier = []
+        for positions, occupied, blank in frontier:
+            rank = pattern_rank(positions, cells)
+            if table[rank] == PDB_UNSEEN:
+                table[rank] = min(depth, PDB_UNSEEN - 1)
+            labels, members = labelled(occupied)
+            for cell in members[labels[blank]]:
+                for neighbor in neighbors[cell]:
+                    if not occupied >> neighbor & 1:
+                        continue
+                    moved = tuple(cell if position == neighbor else position
+                                  for position in positions)
+                    moved_occupied = occupied ^ (1 << neighbor) ^ (1 << cell)
+                    state = (pattern_rank(moved, cells) * cells +
+                             labelled(moved_occupied)[0][neighbor])
+                    if seen[state >> 3] & (1 << (state & 7)):
+                        continue
+                    seen[state >> 3] |= 1 << (state & 7)
+                    next_frontier.append((moved, moved_occupied, neighbor))
+        frontier = next_frontier
+        depth += 1
+    return table
+
+def save_pattern_database(path, puzzle_height, puzzle_width, partition=None):
+    """
+    Build the additive pattern databases of a partition of the
+    numbered tiles (default_partition when None) and write them
+    to a file that PatternDatabase can map
+    """
+    if partition == None:
+        partition = default_partition(puzzle_height, puzzle_width)
+    out = open(path, "wb")
+    try:
+        out.write(struct.pack(PDB_HEADER, PDB_MAGIC, puzzle_height,
+                              puzzle_width, len(partition)))
+        for tiles in partition:
+            out.write(struct.pack("<H%dH" % len(tiles), len(tiles), *tiles))
+        for tiles in partition:
+            out.write(build_pattern_database(puzzle_height, puzzle_width, tiles))
+    finally:
+        out.close()
+
+
+class PatternDatabase:
+    """
+    Read-only additive pattern database file, memory mapped so
+    that loading is immediate and processes share one copy
+    """
+
+    def __init__(self, path):
+        """
+        Map the pattern database file at path
+        Returns a PatternDatabase object
+        """
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._height, self._width, count = struct.unpack_from(
+            PDB_HEADER, self._data, 0)
+        assert magic == PDB_MAGIC, "not a pattern database: " + path
+        offset = struct.calcsize(PDB_HEADER)
+        self._patterns = []
+        for dummy in range(count):
+            length = struct.unpack_from("<H", self._data, offset)[0]
+            offset += 2
+            self._patterns.append(struct.unpack_from("<%dH" % length,
+                                                     self._data, offset))
+            offset += 2 * length
+        cells = self._height * self._width
+        self._offsets = []
+        for tiles in self._patterns:
+            self._offsets.append(offset)
+            offset += pattern_size(len(tiles), cells)
+        assert offset == len(self._data), "truncated pattern database: " + path
+
+    def get_height(self):
+        """
+        Getter for the puzzle height the database was built for
+        Returns an integer
+        """
+        return self._height
+
+    def get_width(self):
+        """
+        Getter for the puzzle width the database was built for
+        Returns an integer
+        """
+        return self._width
+
+    def get_patterns(self):
+        """
+        Getter for the tile groups, in table order
+        Returns a list of tuples of tile numbers
+        """
+        return list(self._patterns)
+
+    def lookup(self, index, positions):
+        """
+        Moves needed by the tiles of pattern index to reach their
+        solved cells from the given cells
+        Returns an integer
+        """
+        rank = pattern_rank(positions, self._height * self._width)
+        return ord(self._data[self._offsets[index] + rank])
+
+    def heuristic(self, tiles):
+        """
+        Additive pattern database estimate for row-major tiles
+        Returns an integer
+        """
+        positions = [0] * len(tiles)
+        for cell, value in enumerate(tiles):
+            positions[value] = cell
+        return sum(self.lookup(index, [positions[tile] for tile in pattern])
+                   for index, pattern in enumerate(self._patterns))
+
+    def close(self):
+        """
+        Release the mapping and the file
+        """
+        self._data.close()
+        self._file.close()
+
+
+class Puzzle(object):
     """
     Class representation for the Fifteen puzzle
+    The tiles are kept in a row-major array together with the
+    inverse array of tile positions, so that locating any tile,
+    including the blank, takes constant time
     """
 
+    __slots__ = ('_height', '_width', '_cells', '_positions', '_search_stats',
+                 '_optimize_stats', '_phase_stats')
+
     def __init__(self, puzzle_height, puzzle_width, initial_grid=None):
         """
         Initialize puzzle with default height and width
@@ -25,14 +394,20 @@ class Puzzle:
         """
         self._height = puzzle_height
         self._width = puzzle_width
-        self._grid = [[col + puzzle_width * row
-                       for col in range(self._width)]
-                      for row in range(self._height)]
+        cells = puzzle_height * puzzle_width
+        self._cells = array(cell_typecode(cells), range(cells))
+        self._search_stats = {}
+        self._optimize_stats = {}
+        self._phase_stats = {}
 
         if initial_grid != None:
             for row in range(puzzle_height):
                 for col in range(puzzle_width):
-                    self._grid[row][col] = initial_grid[row][col]
+                    self._cells[col + puzzle_width * row] = initial_grid[row][col]
+        self._positions = array(self._cells.typecode, [0]) * cells
+        for cell, value in enumerate(self._cells):
+            if value < cells:
+                self._positions[value] = cell
 
     def __str__(self):
         """
@@ -41,7 +416,7 @@ class Puzzle:
         """
         ans = ""
         for row in range(self._height):
-            ans += str(self._grid[row])
+            ans += str(self._cells[row * self._width:(row + 1) * self._width].tolist())
             ans += "\n"
         return ans
 
@@ -67,20 +442,42 @@ class Puzzle:
         Getter for the number at tile position pos
         Returns an integer
         """
-        return self._grid[row][col]
+        return self._cells[col + self._width * row]
 
     def set_number(self, row, col, value):
         """
         Setter for the number at tile position pos
+        Numbers past the last tile are stored but not indexed, as
+        in __init__
         """
-        self._grid[row][col] = value
+        cells = self._cells
+        positions = self._positions
+        assert 0 <= value < 1 << (8 * cells.itemsize), \
+            "number out of range: " + str(value)
+        cell = col + self._width * row
+        old_value = cells[cell]
+        cells[cell] = value
+        if value < len(cells):
+            positions[value] = cell
+        # the overwritten tile may still be elsewhere on the board;
+        # if not, its entry is left for current_position to reject
+        if (old_value != value and old_value < len(cells) and
+                positions[old_value] == cell and old_value in cells):
+            positions[old_value] = cells.index(old_value)
 
     def clone(self):
         """
         Make a copy of the puzzle to update during solving
         Returns a Puzzle object
         """
-        new_puzzle = Puzzle(self._height, self._width, self._grid)
+        new_puzzle = Puzzle.__new__(Puzzle)
+        new_puzzle._height = self._height
+        new_puzzle._width = self._width
+        new_puzzle._cells = self._cells[:]
+        new_puzzle._positions = self._positions[:]
+        new_puzzle._search_stats = {}
+        new_puzzle._optimize_stats = {}
+        new_puzzle._phase_stats = {}
         return new_puzzle
 
     ########################################################
@@ -93,41 +490,96 @@ class Puzzle:
         Returns a tuple of two integers        
         """
         solved_value = (solved_col + self._width * solved_row)
-
-        for row in range(self._height):
-            for col in range(self._width):
-                if self._grid[row][col] == solved_value:
-                    return (row, col)
-        assert False, "Value " + str(solved_value) + " not found"
+        cell = self._positions[solved_value]
+        assert self._cells[cell] == solved_value, "Value " + str(solved_value) + " not found"
+        return divmod(cell, self._width)
 
     def update_puzzle(self, move_string):
         """
         Updates the puzzle state based on the provided move string
+        Strings already compiled for this width are applied in one
+        pass wherever they stay on the grid
         """
-        zero_row, zero_col = self.current_position(0, 0)
+        compiled = COMPILED_MOVES.get((self._width, move_string))
+        if compiled != None and compiled.fits(self._height, self._width,
+                                              self._positions[0]):
+            compiled.apply(self._cells, self._positions, self._positions[0])
+            return
+        width = self._width
+        cells = self._cells
+        positions = self._positions
+        zero = positions[0]
+        zero_row, zero_col = divmod(zero, width)
+        # the blank's own cell is only written once the moves are done,
+        # or before failing, so the board stops at the last legal move
         for direction in move_string:
-            if direction == "l":
-                assert zero_col > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col - 1]
-                self._grid[zero_row][zero_col - 1] = 0
+            if direction == "l" and zero_col > 0:
+                neighbor = zero - 1
                 zero_col -= 1
-            elif direction == "r":
-                assert zero_col < self._width - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col + 1]
-                self._grid[zero_row][zero_col + 1] = 0
+            elif direction == "r" and zero_col < width - 1:
+                neighbor = zero + 1
                 zero_col += 1
-            elif direction == "u":
-                assert zero_row > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row - 1][zero_col]
-                self._grid[zero_row - 1][zero_col] = 0
+            elif direction == "u" and zero_row > 0:
+                neighbor = zero - width
                 zero_row -= 1
-            elif direction == "d":
-                assert zero_row < self._height - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row + 1][zero_col]
-                self._grid[zero_row + 1][zero_col] = 0
+            elif direction == "d" and zero_row < self._height - 1:
+                neighbor = zero + width
                 zero_row += 1
             else:
-                assert False, "invalid direction: " + direction
+                cells[zero] = 0
+                positions[0] = zero
+                assert direction in "lrud", "invalid direction: " + direction
+                assert False, "move off grid: " + direction
+            value = cells[neighbor]
+            cells[zero] = value
+            positions[value] = zero
+            zero = neighbor
+        cells[zero] = 0
+        positions[0] = zero
+
+    def is_solvable(self):
+        """
+        Check that the tiles are a permutation that can reach the
+        solved puzzle: every move is a transposition that moves
+        the blank one cell, so the permutation parity has to match
+        the parity of the blank's distance from the upper left
+        Returns a boolean
+        """
+        cells = self._cells
+        positions = self._positions
+        for value in range(len(cells)):
+            if cells[positions[value]] != value:
+                return False
+        row, col = divmod(positions[0], self._width)
+        return (count_inversions(cells) + row + col) % 2 == 0
+
+    def apply_moves(self, compiled, validate=False):
+        """
+        Apply CompiledMoves in one pass over the cells they touch
+        With validate, first check that they were compiled for this
+        width and stay on the grid from the blank's current cell
+        """
+        blank = self._positions[0]
+        if validate:
+            assert compiled.fits(self._height, self._width, blank), \
+                "moves do not fit this puzzle from cell " + str(blank)
+        compiled.apply(self._cells, self._positions, blank)
+
+    def verify_solution(self, move_string):
+        """
+        Check whether move_string solves the puzzle without changing
+        it; strings with other letters or leaving the grid do not
+        Returns a boolean
+        """
+        if not set(move_string) <= set(OFFSETS):
+            return False
+        # one-off strings are compiled without filling the cache
+        compiled = compile_moves(self._width, move_string, cache=False)
+        if not compiled.fits(self._height, self._width, self._positions[0]):
+            return False
+        puzzle = self.clone()
+        puzzle.apply_moves(compiled)
+        return puzzle._cells == solved_cells(len(self._cells))
 
     ##################################################################
     # Phase one methods
@@ -143,25 +595,12 @@ class Puzzle:
         assert target_col < self._width and target_col >= 0, "column out of grid"
 
         
-        zero_row, zero_col = self.current_position(0, 0)
-        
-        boolean_1 = True
-        for row in range(target_row + 1, self._height):
-            for col in range(self._width):
-                if self._grid[row][col] != col + row * self._width:
-                    boolean_1 = False
-                    break
-            if boolean_1 == False:
-                break
-        
-        boolean_2 = True        
-        if target_col < self._width - 1:
-            for col in range(target_col + 1, self._width):
-                if self._grid[target_row][col] != col + target_row * self._width:
-                    boolean_2 = False
-                    break
-                    
-        return (zero_row, zero_col) == (target_row, target_col) and boolean_1 and boolean_2
+        # the tiles after the target in row-major order are exactly
+        # the rest of the target row and every row below it
+        target = target_col + target_row * self._width
+        solved = solved_cells(len(self._cells))
+        return (self._positions[0] == target and
+                self._cells[target + 1:] == solved[target + 1:])
 
 
     def solve_interior_tile(self, target_row, target_col):
@@ -284,30 +723,13 @@ class Puzzle:
         # replace with your code
         assert target_col < self._width, "target_col out of grid"
         
-        bool_1 = self._grid[0][target_col] == 0
-        if bool_1 == True:
-            bool_2 = True
-            for dummy in range(target_col + 1, self._width):
-                if self._grid[0][dummy] != dummy:
-                    bool_2 = False
-                    break
-
-            bool_3 = True
-            for dummy in range(target_col, self._width):
-                if self._grid[1][dummy] != dummy + self._width:
-                    bool_2 = False
-                    break
-
-            bool_4 = True
-            for dummy_i in range(2, self._height):
-                for dummy_j in range(self._width):
-                    if self._grid[dummy_i][dummy_j] != dummy_j + dummy_i * self._width:
-                        bool_4 = False
-                        break
-                if bool_4 == False:
-                    break
-            return bool_2 and bool_3 and bool_4
-        return bool_1
+        width = self._width
+        solved = solved_cells(len(self._cells))
+        # rest of row zero, then row one from target_col onwards
+        # together with every lower row
+        return (self._positions[0] == target_col and
+                self._cells[target_col + 1:width] == solved[target_col + 1:width] and
+                self._cells[width + target_col:] == solved[width + target_col:])
 
     def row1_invariant(self, target_col):
         """
@@ -318,30 +740,13 @@ class Puzzle:
         # replace with your code
         assert target_col < self._width, "target_col out of grid"
         
-        bool_1 = self._grid[1][target_col] == 0
-        
-        if bool_1 == True:
-            bool_2 = True
-            for row in range(2):
-                for col in range(target_col + 1, self._width):
-                    if self._grid[row][col] != col + row * self._width:
-                        bool_2 = False
-                        break
-                if bool_2 == False:
-                    break
-                    
-            bool_3 = True
-            for dummy_i in range(2, self._height):
-                for dummy_j in range(self._width):
-                    if self._grid[dummy_i][dummy_j] != dummy_j + dummy_i * self._width:
-                        bool_3 = False
-                        break
-                if bool_3 == False:
-                    break
-                    
-            return bool_1 and bool_2 and bool_3
-        
-        return bool_1
+        width = self._width
+        solved = solved_cells(len(self._cells))
+        # rest of row zero, then rest of row one together with
+        # every lower row
+        return (self._positions[0] == width + target_col and
+                self._cells[target_col + 1:width] == solved[target_col + 1:width] and
+                self._cells[width + target_col + 1:] == solved[width + target_col + 1:])
 
     def solve_row0_tile(self, target_col):
         """
@@ -425,6 +830,7 @@ class Puzzle:
         count = 0
         resolved = self.get_number(0,1) == 1 and self.get_number(1,0) == self._width and self.get_number(1,1) == 1 + self._width
         while not resolved:
+            assert count < 3, "unsolvable puzzle"
             count += 1
             self.update_puzzle('rdlu')
             resolved = self.get_number(0,1) == 1 and self.get_number(1,0) == self._width and self.get_number(1,1) == 1 + self._width
@@ -432,39 +838,953 @@ class Puzzle:
         ans += 'rdlu' * count 
         return ans
 
-    def solve_puzzle(self):
+    def solve_puzzle(self, mode=PHASE, node_limit=IDA_NODE_LIMIT,
+                     time_limit=IDA_TIME_LIMIT, pattern_db=None,
+                     optimize=False, window=0):
         """
         Generate a solution string for a puzzle
+        mode is PHASE for the row by row solver, OPTIMAL for the
+        IDA* solver, which uses node_limit, time_limit and
+        pattern_db, or BIDIRECTIONAL for the bidirectional breadth
+        first search, which uses node_limit and time_limit
+        When optimize is set the string is shortened by
+        optimize_moves with the given window
         Updates the puzzle and returns a move string
         """
         # replace with your code
         assert self._height > 1 and self._width > 1, "dimension should at least be 2 x 2"
+        assert self.is_solvable(), "unsolvable puzzle"
+        if optimize:
+            start = self.clone()
+            ans = self.solve_puzzle(mode, node_limit, time_limit, pattern_db)
+            ans, self._optimize_stats = start.optimize_moves(ans, window)
+            return ans
+        if mode == OPTIMAL:
+            return self.solve_optimal(node_limit, time_limit, pattern_db)
+        if mode == BIDIRECTIONAL:
+            return self.solve_bidirectional(node_limit, time_limit)
+        assert mode == PHASE, "unknown solver mode: " + str(mode)
         
-        ans = ""
+        return "".join([chunk[2] for chunk in self.iter_solve()])
+
+    def iter_solve(self):
+        """
+        Solve the puzzle with the phase solver a tile at a time,
+        so moves can be shown or sent while solving continues
+        Generates (phase, tile, move string) tuples, where tile is
+        the number of the tile just placed, or None for the start
+        and 2x2 phases; the puzzle is updated before each yield
+        """
+        assert self._height > 1 and self._width > 1, "dimension should at least be 2 x 2"
+        assert self.is_solvable(), "unsolvable puzzle"
+        self._phase_stats = dict((phase, {'seconds': 0.0, 'moves': 0})
+                                 for phase in PHASES)
         row, col = self.current_position(0,0)
         row_dis = self._height - 1 - row
         col_dis = self._width - 1 - col
         
-        ans += 'r' * col_dis + 'd' * row_dis
-        self.update_puzzle(ans)
+        yield "start", None, self._timed_phase("start", self._move_blank, col_dis, row_dis)
         
         for dum_i in range(self._height - 1, 1, -1):
             for dum_j in range(self._width - 1, -1, -1):
+                tile = dum_j + self._width * dum_i
                 if dum_j > 0:
-                    ans += self.solve_interior_tile(dum_i, dum_j)
+                    yield "interior", tile, self._timed_phase("interior", self.solve_interior_tile, dum_i, dum_j)
                 else:
-                    ans += self.solve_col0_tile(dum_i)
+                    yield "col0", tile, self._timed_phase("col0", self.solve_col0_tile, dum_i)
                 
         for dum_j in range(self._width - 1, 1, -1):
             for dum_i in range(1, -1, -1):
+                tile = dum_j + self._width * dum_i
                 if dum_i == 0:
-                    ans += self.solve_row0_tile(dum_j)
+                    yield "row0", tile, self._timed_phase("row0", self.solve_row0_tile, dum_j)
                 else:
-                    ans += self.solve_row1_tile(dum_j)
+                    yield "row1", tile, self._timed_phase("row1", self.solve_row1_tile, dum_j)
                     
-        ans += self.solve_2x2()
-        
+        yield "2x2", None, self._timed_phase("2x2", self.solve_2x2)
+
+    def _move_blank(self, col_dis, row_dis):
+        """
+        Move the blank right and down by the given distances
+        Updates the puzzle and returns a move string
+        """
+        ans = 'r' * col_dis + 'd' * row_dis
+        self.update_puzzle(ans)
+        return ans
+
+    def _timed_phase(self, phase, method, *args):
+        """
+        Run a solve method, adding its time and moves to the
+        statistics of the given phase
+        Returns the move string of the method
+        """
+        start = time.time()
+        ans = method(*args)
+        self._phase_stats[phase]['seconds'] += time.time() - start
+        self._phase_stats[phase]['moves'] += len(ans)
+        return ans
+
+    def get_phase_stats(self):
+        """
+        Time and moves spent in each phase of the last phase solve,
+        keyed by the names in PHASES
+        Returns a dictionary of dictionaries
+        """
+        return dict((phase, dict(stats)) for phase, stats in self._phase_stats.items())
+
+    ###########################################################
+    # Optimal solver methods
+
+    def _flat_tiles(self):
+        """
+        Copy the grid into a row-major list of tiles
+        Returns a list of integers
+        """
+        return self._cells.tolist()
+
+    def _row_conflict(self, tiles, row):
+        """
+        Linear conflict penalty of a row of the row-major tiles
+        Returns an integer
+        """
+        width = self._width
+        goals = []
+        for col in range(width):
+            value = tiles[row * width + col]
+            if value != 0 and value // width == row:
+                goals.append(value % width)
+        return line_conflict(goals)
+
+    def _col_conflict(self, tiles, col):
+        """
+        Linear conflict penalty of a column of the row-major tiles
+        Returns an integer
+        """
+        width = self._width
+        goals = []
+        for row in range(self._height):
+            value = tiles[row * width + col]
+            if value != 0 and value % width == col:
+                goals.append(value // width)
+        return line_conflict(goals)
+
+    def manhattan_distance(self):
+        """
+        Sum of the distances of all numbered tiles from their
+        solved positions
+        Returns an integer
+        """
+        width = self._width
+        total = 0
+        for cell, value in enumerate(self._flat_tiles()):
+            if value != 0:
+                total += (abs(value // width - cell // width) +
+                          abs(value % width - cell % width))
+        return total
+
+    def linear_conflict(self):
+        """
+        Extra moves forced by tiles that are reversed within
+        their solved row or column
+        Returns an integer
+        """
+        tiles = self._flat_tiles()
+        return (sum(self._row_conflict(tiles, row) for row in range(self._height)) +
+                sum(self._col_conflict(tiles, col) for col in range(self._width)))
+
+    def optimize_moves(self, move_string, window=0):
+        """
+        Shorten a move string that starts from the current puzzle
+        without changing the position it leads to, see shorten_moves
+        Returns a (move string, statistics dictionary) tuple
+        """
+        return shorten_moves(self._height, self._width, self._positions[0],
+                             move_string, window)
+
+    def get_optimize_stats(self):
+        """
+        Statistics of the last optimized solve_puzzle call, as
+        returned by shorten_moves
+        Returns a dictionary
+        """
+        return dict(self._optimize_stats)
+
+    def get_search_stats(self):
+        """
+        Statistics of the last solve_optimal or solve_bidirectional
+        call, such as nodes expanded, elapsed seconds and whether
+        the phase solver was used as a fallback
+        Returns a dictionary
+        """
+        return dict(self._search_stats)
+
+    def solve_optimal(self, node_limit=IDA_NODE_LIMIT, time_limit=IDA_TIME_LIMIT,
+                      pattern_db=None):
+        """
+        Generate a shortest solution string with IDA* search,
+        guided by Manhattan distance plus linear conflict, or by
+        the pattern_db PatternDatabase estimate when it is larger
+        Falls back to solve_puzzle(PHASE) once more than node_limit
+        nodes were expanded or time_limit seconds have passed
+        Updates the puzzle and returns a move string
+        """
+        height = self._height
+        width = self._width
+        tiles = self._flat_tiles()
+        row_lc = [self._row_conflict(tiles, row) for row in range(height)]
+        col_lc = [self._col_conflict(tiles, col) for col in range(width)]
+        positions = [0] * len(tiles)
+        for cell, value in enumerate(tiles):
+            positions[value] = cell
+        patterns = []
+        pattern_of = {}
+        pattern_values = []
+        if pattern_db != None:
+            assert (pattern_db.get_height(), pattern_db.get_width()) == (height, width), \
+                "pattern database built for another puzzle size"
+            patterns = pattern_db.get_patterns()
+            for index, pattern in enumerate(patterns):
+                for tile in pattern:
+                    pattern_of[tile] = index
+                pattern_values.append(pattern_db.lookup(
+                    index, [positions[tile] for tile in pattern]))
+        start = time.time()
+        deadline = start + time_limit
+        # the search recurses once per move of the current bound
+        depth_limit = sys.getrecursionlimit() - 100
+        stats = {'mode': OPTIMAL, 'nodes': 0, 'iterations': 0,
+                 'bound': 0, 'fallback': False, 'seconds': 0.0}
+        self._search_stats = stats
+        path = []
+
+        def search(cost, bound, blank, manhattan, conflict, pattern, last):
+            """
+            Depth first search below the given f-cost bound
+            Returns FOUND, ABORTED or the smallest f-cost over the bound
+            """
+            estimate = cost + max(manhattan + conflict, pattern)
+            if estimate > bound:
+                return estimate
+            if manhattan == 0:
+                return FOUND
+            stats['nodes'] += 1
+            if stats['nodes'] > node_limit:
+                return ABORTED
+            if stats['nodes'] % 1024 == 0 and time.time() > deadline:
+                return ABORTED
+
+            blank_row, blank_col = divmod(blank, width)
+            minimum = float("inf")
+            for direction in "udlr":
+                if direction == INVERSE[last]:
+                    continue
+                row = blank_row + OFFSETS[direction][0]
+                col = blank_col + OFFSETS[direction][1]
+                if row < 0 or row >= height or col < 0 or col >= width:
+                    continue
+                cell = row * width + col
+                value = tiles[cell]
+                goal_row, goal_col = divmod(value, width)
+                tiles[blank] = value
+                tiles[cell] = 0
+                positions[value] = blank
+                new_pattern = pattern
+                if value in pattern_of:
+                    index = pattern_of[value]
+                    old_value = pattern_values[index]
+                    pattern_values[index] = pattern_db.lookup(
+                        index, [positions[tile] for tile in patterns[index]])
+                    new_pattern += pattern_values[index] - old_value
+
+                # the tile slides into the blank, so only its own
+                # distance and the two lines it crosses can change
+                old_lines = None
+                if row == blank_row:
+                    step = abs(goal_col - blank_col) - abs(goal_col - col)
+                    if goal_col == col or goal_col == blank_col:
+                        lines = col_lc
+                        old_lines = (col_lc[col], col_lc[blank_col])
+                        col_lc[col] = self._col_conflict(tiles, col)
+                        col_lc[blank_col] = self._col_conflict(tiles, blank_col)
+                        first, second = col, blank_col
+                else:
+                    step = abs(goal_row - blank_row) - abs(goal_row - row)
+                    if goal_row == row or goal_row == blank_row:
+                        lines = row_lc
+                        old_lines = (row_lc[row], row_lc[blank_row])
+                        row_lc[row] = self._row_conflict(tiles, row)
+                        row_lc[blank_row] = self._row_conflict(tiles, blank_row)
+                        first, second = row, blank_row
+                new_conflict = conflict
+                if old_lines != None:
+                    new_conflict += (lines[first] + lines[second] -
+                                     old_lines[0] - old_lines[1])
+
+                path.append(direction)
+                result = search(cost + 1, bound, cell, manhattan + step,
+                                new_conflict, new_pattern, direction)
+                if result == FOUND or result == ABORTED:
+                    return result
+                path.pop()
+                if old_lines != None:
+                    lines[first], lines[second] = old_lines
+                if value in pattern_of:
+                    pattern_values[index] = old_value
+                positions[value] = cell
+                tiles[cell] = value
+                tiles[blank] = 0
+                if result < minimum:
+                    minimum = result
+            return minimum
+
+        row, col = self.current_position(0, 0)
+        manhattan = self.manhattan_distance()
+        conflict = sum(row_lc) + sum(col_lc)
+        pattern = sum(pattern_values)
+        bound = max(manhattan + conflict, pattern)
+        result = ABORTED
+        while bound <= depth_limit:
+            stats['iterations'] += 1
+            stats['bound'] = bound
+            result = search(0, bound, row * width + col, manhattan,
+                            conflict, pattern, None)
+            if result == FOUND or result == ABORTED:
+                break
+            bound = result
+
+        if result == FOUND:
+            ans = "".join(path)
+            self.update_puzzle(ans)
+        else:
+            stats['fallback'] = True
+            ans = self.solve_puzzle(PHASE)
+        stats['seconds'] = time.time() - start
         return ans
 
+    def _encode(self):
+        """
+        Pack the tiles into one integer, bits_per_cell bits per
+        cell in row-major order
+        Returns an integer
+        """
+        bits = self._bits_per_cell()
+        state = 0
+        for cell in range(len(self._cells) - 1, -1, -1):
+            state = (state << bits) | self._cells[cell]
+        return state
+
+    def _bits_per_cell(self):
+        """
+        Bits needed for the largest tile number
+        Returns an integer
+        """
+        return max(1, (len(self._cells) - 1).bit_length())
+
+    def solve_bidirectional(self, state_limit=IDA_NODE_LIMIT,
+                            time_limit=IDA_TIME_LIMIT):
+        """
+        Generate a shortest solution string with breadth first
+        searches from the puzzle and from the solved puzzle that
+        meet in the middle, over states packed into integers
+        Falls back to solve_puzzle(PHASE) once more than state_limit
+        states are stored or time_limit seconds have passed
+        Updates the puzzle and returns a move string
+        """
+        height = self._height
+        width = self._width
+        bits = self._bits_per_cell()
+        mask = (1 << bits) - 1
+        start = time.time()
+        deadline = start + time_limit
+        stats = {'mode': BIDIRECTIONAL, 'expansions': 0, 'forward': 1,
+                 'backward': 1, 'depth': 0, 'memory': 0, 'fallback': False,
+                 'seconds': 0.0}
+        self._search_stats = stats
+        moves = "udlr"
+        neighbors = []
+        for cell in range(height * width):
+            row, col = divmod(cell, width)
+            neighbors.append([(index, (row + OFFSETS[direction][0]) * width +
+                               col + OFFSETS[direction][1])
+                              for index, direction in enumerate(moves)
+                              if 0 <= row + OFFSETS[direction][0] < height and
+                              0 <= col + OFFSETS[direction][1] < width])
+
+        # each side maps a state to 4 * depth + index of the move
+        # that reached it, enough to walk back and to add up depths
+        origin = self._encode()
+        goal = solved_cells(len(self._cells))
+        goal = sum(value << (bits * cell) for cell, value in enumerate(goal))
+        sides = [{origin: 0}, {goal: 0}]
+        frontiers = [[(origin, self._positions[0])], [(goal, 0)]]
+        depths = [0, 0]
+        meeting = None
+        if origin == goal:
+            meeting = (0, origin)
+        while meeting == None and frontiers[0] and frontiers[1]:
+            side = 0
+            if len(frontiers[1]) < len(frontiers[0]):
+                side = 1
+            seen = sides[side]
+            other = sides[1 - side]
+            depth = depths[side] + 1
+            frontier = []
+            best = None
+            for state, blank in frontiers[side]:
+                stats['expansions'] += 1
+                blank_shift = bits * blank
+                for index, cell in neighbors[blank]:
+                    tile = (state >> (bits * cell)) & mask
+                    moved = state - (tile << (bits * cell)) + (tile << blank_shift)
+                    if moved in seen:
+                        continue
+                    seen[moved] = 4 * depth + index
+                    frontier.append((moved, cell))
+                    if moved in other:
+                        length = depth + other[moved] // 4
+                        if best == None or length < best[0]:
+                            best = (length, moved)
+                if stats['expansions'] % 1024 == 0 and time.time() > deadline:
+                    # a partly expanded layer cannot prove a meeting shortest
+                    frontier = []
+                    best = None
+                    break
+            frontiers[side] = frontier
+            depths[side] = depth
+            stats['forward'] = len(sides[0])
+            stats['backward'] = len(sides[1])
+            stats['depth'] = depths[0] + depths[1]
+            if best != None:
+                meeting = best
+            elif len(sides[0]) + len(sides[1]) > state_limit or time.time() > deadline:
+                break
+
+        stats['memory'] = sum(sys.getsizeof(seen) + len(seen) * sys.getsizeof(origin)
+                              for seen in sides)
+        if meeting == None:
+            stats['fallback'] = True
+            ans = self.solve_puzzle(PHASE)
+        else:
+            # walk from the meeting state back to both ends, undoing
+            # the recorded move of each state in turn
+            halves = []
+            for side in range(2):
+                half = []
+                state = meeting[1]
+                while sides[side][state] >= 4:
+                    direction = moves[sides[side][state] % 4]
+                    half.append(direction)
+                    blank = 0
+                    while (state >> (bits * blank)) & mask:
+                        blank += 1
+                    cell = blank - OFFSETS[direction][0] * width - OFFSETS[direction][1]
+                    tile = (state >> (bits * cell)) & mask
+                    state = state - (tile << (bits * cell)) + (tile << (bits * blank))
+                halves.append(half)
+            ans = "".join(reversed(halves[0])) + "".join(INVERSE[direction]
+                                                          for direction in halves[1])
+            self.update_puzzle(ans)
+        stats['seconds'] = time.time() - start
+        return ans
+
+##################################################################
+# Move optimization
+
+def move_cell(height, width, blank, direction):
+    """
+    Cell the blank moves to from cell blank in the given direction
+    Returns an integer
+    """
+    assert direction in OFFSETS, "invalid direction: " + direction
+    row = blank // width + OFFSETS[direction][0]
+    col = blank % width + OFFSETS[direction][1]
+    assert 0 <= row < height and 0 <= col < width, "move off grid: " + direction
+    return row * width + col
+
+def apply_labels(height, width, blank, move_string, board=None):
+    """
+    Follow move_string from cell blank, recording in board which
+    starting cell's tile now sits in each cell it touched (the
+    blank is labelled with its starting cell)
+    Returns a (board, blank) tuple
+    """
+    if board == None:
+        board = {}
+    start = board.get(blank, blank)
+    for direction in move_string:
+        neighbor = move_cell(height, width, blank, direction)
+        board[blank] = board.get(neighbor, neighbor)
+        board[neighbor] = start
+        blank = neighbor
+    return board, blank
+
+def remove_cycles(height, width, blank, move_string):
+    """
+    Drop every stretch of moves that returns the puzzle to a
+    position it was already in, immediate reversals included
+    Returns a (move string, number of cycles removed) tuple
+    """
+    multipliers = random.Random(HASH_SEED)
+    keys = [multipliers.getrandbits(HASH_BITS) | 1 for dummy in range(height * width)]
+    mask = (1 << HASH_BITS) - 1
+    # position hashes are sums of label * key over cells, so a move
+    # only updates the two cells it swaps; equal hashes are
+    # confirmed by replaying the stretch in between
+    board = {}
+    position = 0
+    path = []
+    hashes = [position]
+    blanks = [blank]
+    first = {position: 0}
+    cycles = 0
+    for direction in move_string:
+        neighbor = move_cell(height, width, blank, direction)
+        label = board.get(neighbor, neighbor)
+        empty = board.get(blank, blank)
+        position = (position + (label - empty) * (keys[blank] - keys[neighbor])) & mask
+        board[blank] = label
+        board[neighbor] = empty
+        blank = neighbor
+        path.append(direction)
+        hashes.append(position)
+        blanks.append(blank)
+        index = first.get(position)
+        if index == None:
+            first[position] = len(path)
+            continue
+        stretch, dummy = apply_labels(height, width, blanks[index], path[index:])
+        if any(cell != label for cell, label in stretch.items()):
+            continue
+        for later in range(index + 1, len(path)):
+            if first.get(hashes[later]) == later:
+                del first[hashes[later]]
+        del path[index:]
+        del hashes[index + 1:]
+        del blanks[index + 1:]
+        cycles += 1
+    return "".join(path), cycles
+
+def shortest_moves(height, width, blank, move_string):
+    """
+    Search for a strictly shorter move string with the same
+    effect as move_string from cell blank
+    Returns the shorter string or None
+    """
+    target, end = apply_labels(height, width, blank, move_string)
+    goal = dict((label, cell) for cell, label in target.items())
+    start = target.get(end, end)
+    goal.pop(start, None)
+
+    def distance(label, cell):
+        """
+        Moves the tile labelled label needs from cell to its goal
+        """
+        goal_cell = goal.get(label, label)
+        return (abs(goal_cell // width - cell // width) +
+                abs(goal_cell % width - cell % width))
+
+    board = {}
+    path = []
+
+    def search(cost, bound, cell, estimate, last):
+        """
+        Depth first search within the bound, building path
+        Returns True once the target position is reached
+        """
+        if estimate == 0:
+            return True
+        if cost + estimate > bound:
+            return False
+        for direction in "udlr":
+            if direction == INVERSE[last]:
+                continue
+            row = cell // width + OFFSETS[direction][0]
+            col = cell % width + OFFSETS[direction][1]
+            if row < 0 or row >= height or col < 0 or col >= width:
+                continue
+            neighbor = row * width + col
+            label = board.get(neighbor, neighbor)
+            step = distance(label, cell) - distance(label, neighbor)
+            board[cell] = label
+            board[neighbor] = start
+            path.append(direction)
+            if search(cost + 1, bound, neighbor, estimate + step, direction):
+                return True
+            path.pop()
+            board[neighbor] = label
+            board[cell] = start
+        return False
+
+    # before any move every tile still sits in the cell it is named after
+    estimate = sum(distance(label, label) for label in goal)
+    # every move changes the parity of the blank's position, so a
+    # shorter equivalent is at least two moves shorter
+    for bound in range(estimate, len(move_string) - 1, 2):
+        if search(0, bound, blank, estimate, None):
+            return "".join(path)
+    return None
+
+def shorten_moves(height, width, blank, move_string, window=0):
+    """
+    Shorten a move string that starts with the blank at cell
+    blank: remove every cycle back to an earlier position and,
+    when window is positive, replace each run of window moves by
+    a shortest equivalent found by search
+    Returns a (move string, statistics dictionary) tuple
+    """
+    moves, cycles = remove_cycles(height, width, blank, move_string)
+    improved = 0
+    if window > 0:
+        pieces = []
+        cell = blank
+        for start in range(0, len(moves), window):
+            piece = moves[start:start + window]
+            shorter = shortest_moves(height, width, cell, piece)
+            if shorter != None:
+                piece = shorter
+                improved += 1
+            pieces.append(piece)
+            dummy, cell = apply_labels(height, width, cell, piece)
+        if improved:
+            moves, more = remove_cycles(height, width, blank, "".join(pieces))
+            cycles += more
+    stats = {'original': len(move_string), 'optimized': len(moves),
+             'saved': len(move_string) - len(moves), 'cycles': cycles,
+             'windows': improved}
+    return moves, stats
+
+##################################################################
+# Compiled moves
+
+class CompiledMoves(object):
+    """
+    A move string compiled, for one puzzle width, into the cells
+    it rearranges as offsets from the blank's starting cell, so
+    it applies wherever the blank's path stays on the grid
+    """
+
+    __slots__ = ('_width', '_moves', '_bounds', '_end', '_targets',
+                 '_sources')
+
+    def __init__(self, width, move_string):
+        """
+        Follow move_string from a blank at offset (0, 0), recording
+        the rows and columns its path reaches and, for each cell it
+        touched, the offset of the tile that ends up there
+        Returns a CompiledMoves object
+        """
+        self._width = width
+        self._moves = move_string
+        row = col = 0
+        low_row = high_row = low_col = high_col = 0
+        source = {}
+        for direction in move_string:
+            assert direction in OFFSETS, "invalid direction: " + direction
+            neighbor = (row + OFFSETS[direction][0], col + OFFSETS[direction][1])
+            source[(row, col)] = source.get(neighbor, neighbor)
+            row, col = neighbor
+            low_row = min(low_row, row)
+            high_row = max(high_row, row)
+            low_col = min(low_col, col)
+            high_col = max(high_col, col)
+        source[(row, col)] = (0, 0)
+        self._bounds = (low_row, high_row, low_col, high_col)
+        self._end = (row, col)
+        moved = [(target, origin) for target, origin in source.items()
+                 if target != origin]
+        self._targets = tuple(row * width + col for (row, col), dummy in moved)
+        self._sources = tuple(row * width + col for dummy, (row, col) in moved)
+
+    def get_width(self):
+        """
+        Getter for the puzzle width compiled for
+        Returns an integer
+        """
+        return self._width
+
+    def get_moves(self):
+        """
+        Getter for the move string compiled
+        Returns a string
+        """
+        return self._moves
+
+    def get_length(self):
+        """
+        Getter for the number of moves compiled
+        Returns an integer
+        """
+        return len(self._moves)
+
+    def get_end(self):
+        """
+        Getter for where the blank ends up, relative to its start
+        Returns a (row, col) tuple
+        """
+        return self._end
+
+    def fits(self, height, width, blank):
+        """
+        Check whether the moves stay on a height by width grid
+        when the blank starts at cell blank
+        Returns a boolean
+        """
+        low_row, high_row, low_col, high_col = self._bounds
+        row, col = divmod(blank, width)
+        return (width == self._width and row + low_row >= 0 and
+                row + high_row < height and col + low_col >= 0 and
+                col + high_col < width)
+
+    def apply(self, cells, positions, blank):
+        """
+        Rearrange cells and their inverse positions in place for
+        a blank starting at cell blank, which has to fit
+        """
+        values = [cells[blank + origin] for origin in self._sources]
+        for target, value in zip(self._targets, values):
+            cells[blank + target] = value
+            positions[value] = blank + target
+
+    def then(self, other):
+        """
+        Compose with moves that follow these ones
+        Returns a CompiledMoves object
+        """
+        assert other._width == self._width, "moves compiled for another width"
+        return CompiledMoves(self._width, self._moves + other._moves)
+
+def compile_moves(width, move_string, cache=True):
+    """
+    Compile move_string for puzzles of the given width; with
+    cache, results are kept so repeated macros compile once and
+    update_puzzle applies them at any blank cell they fit
+    Returns a CompiledMoves object
+    """
+    key = (width, move_string)
+    if key in COMPILED_MOVES:
+        return COMPILED_MOVES[key]
+    compiled = CompiledMoves(width, move_string)
+    if cache:
+        if len(COMPILED_MOVES) >= COMPILED_CACHE_SIZE:
+            COMPILED_MOVES.clear()
+        COMPILED_MOVES[key] = compiled
+    return compiled
+
+##################################################################
+# Benchmarks
+
+def random_puzzle(puzzle_height, puzzle_width, seed):
+    """
+    Seeded random solvable puzzle: a shuffled board with two
+    numbered tiles swapped when its parity is wrong
+    Returns a Puzzle object
+    """
+    tiles = range(puzzle_height * puzzle_width)
+    random.Random(seed).shuffle(tiles)
+    puzzle = Puzzle(puzzle_height, puzzle_width,
+                    [tiles[row * puzzle_width:(row + 1) * puzzle_width]
+                     for row in range(puzzle_height)])
+    if not puzzle.is_solvable():
+        first = puzzle.current_position(0, 1)
+        second = puzzle.current_position(*divmod(2, puzzle_width))
+        puzzle.set_number(first[0], first[1], 2)
+        puzzle.set_number(second[0], second[1], 1)
+    return puzzle
+
+def benchmark_solver(sizes=BENCHMARK_SIZES, trials=3, seed=0, mode=PHASE):
+    """
+    Solve trials random puzzles of every (height, width) size,
+    the puzzles of trial t being built from seed + t
+    Returns a list of dictionaries with the size, trial, seed,
+    total seconds, move count and per-phase statistics
+    """
+    results = []
+    for height, width in sizes:
+        for trial in range(trials):
+            puzzle = random_puzzle(height, width, seed + trial)
+            start = time.time()
+            moves = puzzle.solve_puzzle(mode)
+            results.append({'height': height, 'width': width, 'trial': trial,
+                            'seed': seed + trial, 'mode': mode,
+                            'seconds': time.time() - start, 'moves': len(moves),
+                            'phases': puzzle.get_phase_stats()})
+    return results
+
+def write_benchmark(results, stream):
+    """
+    Write benchmark results as one JSON object per line
+    """
+    for result in results:
+        stream.write(json.dumps(result, sort_keys=True))
+        stream.write("\n")
+
+def read_benchmark(stream):
+    """
+    Read results written by write_benchmark
+    Returns a list of dictionaries
+    """
+    return [json.loads(line) for line in stream if line.strip()]
+
+def find_regressions(baseline, results, time_tolerance=0.25):
+    """
+    Compare benchmark results with a baseline run of the same
+    sizes, trials and seed: any increase in moves, or a solve
+    slower by more than time_tolerance, is a regression
+    Returns a list of messages
+    """
+    def key(result):
+        """
+        Identity of a benchmark run
+        """
+        return (result['mode'], result['height'], result['width'], result['seed'])
+
+    expected = dict((key(result), result) for result in baseline)
+    messages = []
+    for result in results:
+        old = expected.get(key(result))
+        if old == None:
+            continue
+        name = "%s %dx%d seed %d" % key(result)
+        if result['moves'] > old['moves']:
+            messages.append("%s: %d moves, was %d" % (name, result['moves'], old['moves']))
+        if result['seconds'] > old['seconds'] * (1 + time_tolerance):
+            messages.append("%s: %.4fs, was %.4fs" % (name, result['seconds'], old['seconds']))
+    return messages
+
+##################################################################
+# Batch solving
+
+def read_boards(stream):
+    """
+    Parse newline-delimited JSON boards, each either a list of
+    rows or an object with a "grid" list of rows
+    Generates boards as lists of rows
+    """
+    for line in stream:
+        line = line.strip()
+        if line:
+            board = json.loads(line)
+            if isinstance(board, dict):
+                board = board.get("grid")
+            yield board
+
+def read_binary_boards(stream):
+    """
+    Parse packed boards, each a little-endian unsigned 16 bit
+    height and width followed by the tiles in row-major order
+    Generates boards as lists of rows
+    """
+    header_size = struct.calcsize(BOARD_HEADER)
+    while True:
+        header = stream.read(header_size)
+        if len(header) < header_size:
+            return
+        height, width = struct.unpack(BOARD_HEADER, header)
+        tiles = array("H")
+        tiles.fromstring(stream.read(2 * height * width))
+        if sys.byteorder == "big":
+            tiles.byteswap()
+        yield [tiles[row * width:(row + 1) * width].tolist()
+               for row in range(height)]
+
+def write_binary_board(stream, board):
+    """
+    Append a board given as a list of rows in the format read
+    by read_binary_boards
+    """
+    tiles = array("H", [value for row in board for value in row])
+    if sys.byteorder == "big":
+        tiles.byteswap()
+    stream.write(struct.pack(BOARD_HEADER, len(board), len(board[0])))
+    stream.write(tiles.tostring())
+
+def board_error(board):
+    """
+    Check that a board is a rectangular list of rows holding
+    each of the numbers 0 to height * width - 1 once
+    Returns a description of the first problem found, or None
+    """
+    if not isinstance(board, list) or not board:
+        return "board is not a list of rows"
+    if not isinstance(board[0], list) or not board[0]:
+        return "row 0 is not a list of tiles"
+    width = len(board[0])
+    tiles = []
+    for row, line in enumerate(board):
+        if not isinstance(line, list) or len(line) != width:
+            return "row " + str(row) + " does not have " + str(width) + " tiles"
+        tiles.extend(line)
+    if sorted(tiles) != range(len(tiles)):
+        return "tiles are not 0 to " + str(len(tiles) - 1)
+    return None
+
+def solve_board(task):
+    """
+    Solve one (board, mode, pattern_path) task in a worker,
+    mapping each pattern database file once per process
+    Returns a (moves, seconds, error) tuple, moves being None and
+    error a description when the board cannot be solved
+    """
+    board, mode, pattern_path = task
+    start = time.time()
+    error = board_error(board)
+    if error != None:
+        return None, time.time() - start, error
+    # one bad board should not take the rest of the batch with it
+    try:
+        pattern_db = None
+        if pattern_path != None:
+            if pattern_path not in WORKER_DATABASES:
+                WORKER_DATABASES[pattern_path] = PatternDatabase(pattern_path)
+            pattern_db = WORKER_DATABASES[pattern_path]
+        puzzle = Puzzle(len(board), len(board[0]), board)
+        if not puzzle.is_solvable():
+            return None, time.time() - start, "unsolvable"
+        moves = puzzle.solve_puzzle(mode, pattern_db=pattern_db)
+    except Exception as exc:
+        return None, time.time() - start, repr(exc)
+    return moves, time.time() - start, None
+
+def solve_batch(boards, processes=None, chunk_size=BATCH_CHUNK_SIZE,
+                mode=PHASE, pattern_path=None):
+    """
+    Solve an iterable of boards on a pool of processes (one per
+    CPU when None), handing them out chunk_size at a time
+    Generates (index, moves, seconds, error) tuples in input order,
+    error being None for solved boards
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        tasks = ((board, mode, pattern_path) for board in boards)
+        results = pool.imap(solve_board, tasks, chunk_size)
+        for index, (moves, seconds, error) in enumerate(results):
+            yield index, moves, seconds, error
+    finally:
+        pool.terminate()
+        pool.join()
+
+def run_batch(in_stream, out_stream, binary=False, processes=None,
+              chunk_size=BATCH_CHUNK_SIZE, mode=PHASE, pattern_path=None):
+    """
+    Solve every board of in_stream, newline-delimited JSON or
+    packed binary boards, and write one JSON line per board with
+    its index, moves and solving time as soon as it is in order
+    (moves is null with an error for malformed or unsolvable
+    boards)
+    """
+    if binary:
+        boards = read_binary_boards(in_stream)
+    else:
+        boards = read_boards(in_stream)
+    for index, moves, seconds, error in solve_batch(boards, processes,
+                                                    chunk_size, mode,
+                                                    pattern_path):
+        result = {"index": index, "moves": moves, "seconds": seconds}
+        if error != None:
+            result["error"] = error
+        out_stream.write(json.dumps(result, sort_keys=True))
+        out_stream.write("\n")
+        out_stream.flush()
+
 # Start interactive simulation
 
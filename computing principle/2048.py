@@ -3,7 +3,19 @@
     """
 
 import poc_2048_gui
+import copy
+import multiprocessing
 import random
+import struct
+import time
+from collections import OrderedDict
+from operator import itemgetter
+
+# numpy is only needed by the batch simulator
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Directions, DO NOT MODIFY
 UP = 1
@@ -18,6 +30,72 @@ OFFSETS = {UP: (1, 0),
     LEFT: (0, 1),
     RIGHT: (0, -1)}
 
+# Bitboard engine: a 4 x 4 board packed into one integer of 4 bit
+# tile exponents, row r in bits 16 * r to 16 * r + 15 and column c
+# in the nibble at bit 4 * c of its row.
+BITBOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+TILE_MASK = 0xF
+
+# results of moving every possible row left or right, and the
+# score of the merges, filled in by build_row_tables
+ROW_LEFT = []
+ROW_RIGHT = []
+ROW_SCORE = []
+
+# Expectimax player: search depth in moves, chance branches less
+# likely than the cutoff are evaluated directly, and at most
+# CACHE_SIZE boards are kept in the transposition table
+EXPECTIMAX_DEPTH = 3
+PROBABILITY_CUTOFF = 0.0001
+CACHE_SIZE = 200000
+
+# weights of the evaluation, summed over every row and column
+LOST_PENALTY = 200000.0
+EMPTY_WEIGHT = 270.0
+MERGE_WEIGHT = 700.0
+MONOTONIC_WEIGHT = 47.0
+MONOTONIC_POWER = 4.0
+SUM_WEIGHT = 11.0
+SUM_POWER = 3.5
+
+# evaluation of every packed row, filled in by build_heuristic_table
+ROW_HEURISTIC = []
+
+# Monte Carlo player: random games played out after each first
+# move, handed to the workers ROLLOUT_CHUNK at a time
+MONTE_CARLO_ROLLOUTS = 40
+ROLLOUT_CHUNK = 4
+
+# Game recordings: a header, then blocks made of a keyframe (move
+# number, score and one exponent byte per cell) followed by up to
+# KEYFRAME_INTERVAL two byte move records
+RECORD_MAGIC = "G2K1"
+RECORD_HEADER = "<4sHHH"
+KEYFRAME_HEADER = "<II"
+KEYFRAME_INTERVAL = 64
+
+# flags in the first byte of a move record, next to the direction
+SPAWN_FOUR = 8
+SPAWNED = 16
+
+# Flat engine: directions of an n dimensional board are (axis,
+# toward start) pairs, the 2-D directions map onto the first two
+# axes, and the lines of each (shape, direction) are built once
+FLAT_DIRECTIONS = {UP: (0, True), DOWN: (0, False),
+                   LEFT: (1, True), RIGHT: (1, False)}
+LINE_INDICES = {}
+
+# board sizes timed by benchmark_engines
+BENCHMARK_SIZES = (4, 8, 16, 32, 64)
+
+# results of merge_memo keyed by line tuple, emptied when full
+MERGE_CACHE = {}
+MERGE_CACHE_SIZE = 1 << 16
+
+# directions in the order of the batch simulator's move axis
+BATCH_DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
+
 # get the none zero list to paire
 def get_none_zero_list(line):
     """
@@ -134,6 +212,62 @@ def merge(line):
         return none_zero_list + zero_list
 
 
+def merge_into(line, out):
+    """
+        Single pass merge of line into out, which may be line
+        itself. Returns the score gained and whether the line
+        changed.
+        """
+    length = len(line)
+    write = 0
+    pending = 0
+    score = 0
+    changed = False
+    # pending holds a tile waiting for its partner; every output
+    # cell is compared with the input before it is overwritten
+    for index in range(length):
+        value = line[index]
+        if value == 0:
+            continue
+        if pending == 0:
+            pending = value
+            continue
+        if pending == value:
+            value = 2 * pending
+            score += value
+            pending = 0
+        else:
+            value, pending = pending, value
+        changed = changed or line[write] != value
+        out[write] = value
+        write += 1
+    if pending:
+        changed = changed or line[write] != pending
+        out[write] = pending
+        write += 1
+    for index in range(write, length):
+        changed = changed or line[index] != 0
+        out[index] = 0
+    return score, changed
+
+
+def merge_memo(line):
+    """
+        merge_into with the results cached by the line's tuple.
+        Returns a (merged tuple, score, changed) triple.
+        """
+    key = tuple(line)
+    result = MERGE_CACHE.get(key)
+    if result == None:
+        if len(MERGE_CACHE) >= MERGE_CACHE_SIZE:
+            MERGE_CACHE.clear()
+        out = [0] * len(key)
+        score, changed = merge_into(key, out)
+        result = (tuple(out), score, changed)
+        MERGE_CACHE[key] = result
+    return result
+
+
 def adjust_grid(grid,direction):
     """
         to reverse the grid we get after move
@@ -164,11 +298,15 @@ class TwentyFortyEight:
         Class to run the game logic.
         """
     
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, seed=None):
         # replace with your code
         self._grid_height = grid_height
         self._grid_width = grid_width
         
+        # tiles are spawned from a private generator so that a seeded
+        # game is reproducible
+        self._random = random.Random(seed)
+        
         #initiate all tiles' value to 0
         self._grid_2048 = [[0 for col in range(self._grid_width)] for row in range(self._grid_height)]
         
@@ -192,6 +330,14 @@ class TwentyFortyEight:
         #initiate all tiles' value to 0
         self._grid_2048 = [[0 for dummy_col in range(self._grid_width)] for dummy_row in range(self._grid_height)]
         
+        # every cell starts empty; _empty_index maps a cell to its
+        # position in _empty so set_tile can update both in O(1)
+        self._empty = [(row, col) for row in range(self._grid_height)
+                       for col in range(self._grid_width)]
+        self._empty_index = dict((cell, index) for index, cell in enumerate(self._empty))
+        self._score = 0
+        self._last_spawn = None
+        
         # two new tiles
         self.new_tile()
         self.new_tile()
@@ -233,23 +379,73 @@ class TwentyFortyEight:
         # replace with your code
         return self._grid_width
     
+    def get_score(self):
+        """
+            Get the sum of the tiles made by merges so far.
+            """
+        return self._score
+    
+    def set_score(self, score):
+        """
+            Set the score, for games restored from a recording.
+            """
+        self._score = score
+    
+    def get_last_spawn(self):
+        """
+            Get the (row, col, value) of the last new tile, or None
+            if the last call to new_tile found the board full.
+            """
+        return self._last_spawn
+    
+    def clone(self, seed=None):
+        """
+            Return an independent copy of the game.  The copy
+            continues this game's random tiles unless it is given
+            its own seed.
+            """
+        game = copy.copy(self)
+        game._grid_2048 = [list(row) for row in self._grid_2048]
+        game._empty = list(self._empty)
+        game._empty_index = dict(self._empty_index)
+        game._random = random.Random(seed)
+        if seed == None:
+            game._random.setstate(self._random.getstate())
+        return game
+    
     def move(self, direction):
         """
             Move all tiles in the given direction and add
-            a new tile if any tiles moved.
+            a new tile if any tiles moved.  Returns True when
+            the board changed.
+            """
+        changed = self.shift_tiles(direction)
+        if changed:
+            self.new_tile()
+        return changed
+    
+    def shift_tiles(self, direction):
+        """
+            Move all tiles in the given direction without adding
+            a new tile.  Returns True when the board changed.
             """
         new_grid = []
+        changed = False
+        score = 0
         # get the indices of specific direction
         new_indices = self._grid_indices[direction]
         for cell in new_indices:
             lst = self.traversed_list(cell, direction)
-            merged_list = merge(lst)
-            new_grid.append(merged_list)
+            gained, line_changed = merge_into(lst, lst)
+            score += gained
+            changed = changed or line_changed
+            new_grid.append(lst)
         
         adjusted_grid = adjust_grid(new_grid,direction)
-        if self.is_changed(adjusted_grid):
+        if changed:
+            self._score += score
             self.update_grid(adjusted_grid)
-            self.new_tile()
+        return changed
     
     
     def update_grid(self,grid):
@@ -265,23 +461,22 @@ class TwentyFortyEight:
         """
             Create a new tile in a randomly selected empty
             square.  The tile should be 2 90% of the time and
-            4 10% of the time.
+            4 10% of the time.  Does nothing on a full board.
             """
+        self._last_spawn = None
+        if not self._empty:
+            return
         
-        # get random corordinates for new tile
-        row = random.randint(0,self._grid_width)
-        col = random.randint(0,self._grid_height)
-        #  keeps generating random tile corordinates for non-empty tile
-        while self.get_tile(row,col) != 0:
-            row = random.randint(0,self._grid_width)
-            col = random.randint(0,self._grid_height)
+        # pick a cell straight from the empty cell list
+        row, col = self._empty[self._random.randrange(len(self._empty))]
         
         # get random index of new tile value
-        freq = random.randint(0,9)
+        freq = self._random.randint(0,9)
         if freq == 9:
             self.set_tile(row, col, 4)
         else:
             self.set_tile(row, col, 2)
+        self._last_spawn = (row, col, self.get_tile(row, col))
     
     
     
@@ -290,7 +485,25 @@ class TwentyFortyEight:
             Set the tile at position row, col to have the given value.
             """
         # replace with your code
+        old_value = self._grid_2048[row][col]
         self._grid_2048[row][col] = value
+        
+        # keep the empty cell list in step with the grid
+        if old_value == 0 and value != 0:
+            index = self._empty_index.pop((row, col))
+            last = self._empty.pop()
+            if index < len(self._empty):
+                self._empty[index] = last
+                self._empty_index[last] = index
+        elif old_value != 0 and value == 0:
+            self._empty_index[(row, col)] = len(self._empty)
+            self._empty.append((row, col))
+    
+    def get_empty_cells(self):
+        """
+            Return a list of the empty cells as (row, col) tuples.
+            """
+        return list(self._empty)
     
     def get_tile(self, row, col):
         """
@@ -338,4 +551,1203 @@ class TwentyFortyEight:
 
 
 
+def reverse_row(row):
+    """
+        reverse the order of the four tiles of a packed row
+        """
+    return (((row & 0xF) << 12) | ((row & 0xF0) << 4) |
+            ((row >> 4) & 0xF0) | (row >> 12))
+
+
+def build_row_tables():
+    """
+        Fill ROW_LEFT, ROW_RIGHT and ROW_SCORE for all 65536 rows,
+        once per process, with the same semantics as merge.
+        Exponent 15 is the largest that fits a nibble, so those
+        tiles never merge.
+        """
+    if ROW_LEFT:
+        return
+    right = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        exponents = [(row >> (4 * col)) & TILE_MASK for col in range(BITBOARD_SIZE)]
+        # give 32768 tiles distinct values so that merge keeps them apart
+        line = []
+        for col in range(BITBOARD_SIZE):
+            if exponents[col] == TILE_MASK:
+                line.append((1 << TILE_MASK) + col)
+            elif exponents[col]:
+                line.append(1 << exponents[col])
+            else:
+                line.append(0)
+        merged = [0] * BITBOARD_SIZE
+        score = merge_into(line, merged)[0]
+        packed = 0
+        for col in range(BITBOARD_SIZE):
+            value = min(merged[col], 1 << TILE_MASK)
+            if value:
+                packed |= (value.bit_length() - 1) << (4 * col)
+        ROW_LEFT.append(packed)
+        ROW_SCORE.append(score)
+        right[reverse_row(row)] = reverse_row(packed)
+    ROW_RIGHT.extend(right)
+
+
+def transpose(board):
+    """
+        swap rows and columns of a packed board
+        """
+    first = board & 0xF0F00F0FF0F00F0F
+    first |= (board & 0x0000F0F00000F0F0) << 12
+    first |= (board & 0x0F0F00000F0F0000) >> 12
+    second = first & 0xFF00FF0000FF00FF
+    second |= (first & 0x00FF00FF00000000) >> 24
+    second |= (first & 0x00000000FF00FF00) << 24
+    return second
+
+
+def move_rows(board, table):
+    """
+        look up the four rows of a packed board in a row table
+        """
+    return (table[board & ROW_MASK] |
+            (table[(board >> 16) & ROW_MASK] << 16) |
+            (table[(board >> 32) & ROW_MASK] << 32) |
+            (table[board >> 48] << 48))
+
+
+def row_scores(board):
+    """
+        score of merging the four rows of a packed board
+        """
+    return (ROW_SCORE[board & ROW_MASK] + ROW_SCORE[(board >> 16) & ROW_MASK] +
+            ROW_SCORE[(board >> 32) & ROW_MASK] + ROW_SCORE[board >> 48])
+
+
+def bitboard_move(board, direction):
+    """
+        Move a packed board in the given direction without adding
+        a tile. Returns the new board and the score gained.
+        """
+    if direction == LEFT:
+        return move_rows(board, ROW_LEFT), row_scores(board)
+    elif direction == RIGHT:
+        return move_rows(board, ROW_RIGHT), row_scores(reverse_board(board))
+    columns = transpose(board)
+    if direction == UP:
+        return transpose(move_rows(columns, ROW_LEFT)), row_scores(columns)
+    return transpose(move_rows(columns, ROW_RIGHT)), row_scores(reverse_board(columns))
+
+
+def reverse_board(board):
+    """
+        reverse every row of a packed board
+        """
+    return (reverse_row(board & ROW_MASK) |
+            (reverse_row((board >> 16) & ROW_MASK) << 16) |
+            (reverse_row((board >> 32) & ROW_MASK) << 32) |
+            (reverse_row(board >> 48) << 48))
+
+
+class BitboardTwentyFortyEight:
+    """
+        4 x 4 game logic on a packed integer board, with the same
+        interface as TwentyFortyEight.
+        """
+    
+    def __init__(self, grid_height=BITBOARD_SIZE, grid_width=BITBOARD_SIZE,
+                 seed=None):
+        assert grid_height == BITBOARD_SIZE and grid_width == BITBOARD_SIZE, \
+            "the bitboard engine only plays 4 x 4 games"
+        build_row_tables()
+        # tiles come from a private generator, as in TwentyFortyEight
+        self._random = random.Random(seed)
+        self._board = 0
+        self._score = 0
+        self.reset()
+    
+    def reset(self):
+        """
+            Reset the game so the grid is empty except for two
+            initial tiles.
+            """
+        self._board = 0
+        self._score = 0
+        self.new_tile()
+        self.new_tile()
+    
+    def __str__(self):
+        """
+            Return a string representation of the grid for debugging.
+            """
+        return str([[self.get_tile(row, col) for col in range(BITBOARD_SIZE)]
+                    for row in range(BITBOARD_SIZE)])
+    
+    def get_grid_height(self):
+        """
+            Get the height of the board.
+            """
+        return BITBOARD_SIZE
+    
+    def get_grid_width(self):
+        """
+            Get the width of the board.
+            """
+        return BITBOARD_SIZE
+    
+    def get_board(self):
+        """
+            Get the packed board.
+            """
+        return self._board
+    
+    def set_board(self, board):
+        """
+            Replace the packed board.
+            """
+        self._board = board
+    
+    def get_score(self):
+        """
+            Get the total value of all merges so far.
+            """
+        return self._score
+    
+    def clone(self, seed=None):
+        """
+            Return an independent copy of the game.  The copy
+            continues this game's random tiles unless it is given
+            its own seed.
+            """
+        game = copy.copy(self)
+        game._random = random.Random(seed)
+        if seed == None:
+            game._random.setstate(self._random.getstate())
+        return game
+    
+    def move(self, direction):
+        """
+            Move all tiles in the given direction and add
+            a new tile if any tiles moved.  Returns True when
+            the board changed.
+            """
+        board, score = bitboard_move(self._board, direction)
+        if board == self._board:
+            return False
+        self._board = board
+        self._score += score
+        self.new_tile()
+        return True
+    
+    def new_tile(self):
+        """
+            Create a new tile in a randomly selected empty
+            square.  The tile should be 2 90% of the time and
+            4 10% of the time.
+            """
+        empty = [shift for shift in range(0, 64, 4)
+                 if not (self._board >> shift) & TILE_MASK]
+        if empty:
+            exponent = 1
+            if self._random.randint(0, 9) == 9:
+                exponent = 2
+            self._board |= exponent << self._random.choice(empty)
+    
+    def set_tile(self, row, col, value):
+        """
+            Set the tile at position row, col to have the given value.
+            """
+        shift = 16 * row + 4 * col
+        exponent = 0
+        if value:
+            exponent = value.bit_length() - 1
+        assert value == 0 or (value == 1 << exponent and exponent <= TILE_MASK), \
+            "tile values must be powers of two up to 32768"
+        self._board = (self._board & ~(TILE_MASK << shift)) | (exponent << shift)
+    
+    def get_tile(self, row, col):
+        """
+            Return the value of the tile at position row, col.
+            """
+        exponent = int((self._board >> (16 * row + 4 * col)) & TILE_MASK)
+        if exponent:
+            return 1 << exponent
+        return 0
+
+
+def build_heuristic_table():
+    """
+        Fill ROW_HEURISTIC for all 65536 rows, once per process:
+        reward empty cells and equal neighbours, penalise rows
+        that are not monotonic and large tiles left scattered.
+        """
+    if ROW_HEURISTIC:
+        return
+    for row in range(ROW_MASK + 1):
+        exponents = [(row >> (4 * col)) & TILE_MASK for col in range(BITBOARD_SIZE)]
+        empty = exponents.count(0)
+        merges = 0
+        previous = 0
+        run = 0
+        for exponent in exponents:
+            if exponent == 0:
+                continue
+            if exponent == previous:
+                run += 1
+            elif run > 0:
+                merges += 1 + run
+                run = 0
+            previous = exponent
+        if run > 0:
+            merges += 1 + run
+        left = 0.0
+        right = 0.0
+        for col in range(1, BITBOARD_SIZE):
+            before = exponents[col - 1] ** MONOTONIC_POWER
+            after = exponents[col] ** MONOTONIC_POWER
+            if exponents[col - 1] > exponents[col]:
+                left += before - after
+            else:
+                right += after - before
+        total = sum(exponent ** SUM_POWER for exponent in exponents)
+        ROW_HEURISTIC.append(LOST_PENALTY + EMPTY_WEIGHT * empty +
+                             MERGE_WEIGHT * merges -
+                             MONOTONIC_WEIGHT * min(left, right) -
+                             SUM_WEIGHT * total)
+
+
+def pack_board(game):
+    """
+        Packed board of a 4 x 4 game, read through get_tile.
+        """
+    assert game.get_grid_height() == BITBOARD_SIZE and \
+        game.get_grid_width() == BITBOARD_SIZE, "only 4 x 4 games can be packed"
+    board = 0
+    for row in range(BITBOARD_SIZE):
+        for col in range(BITBOARD_SIZE):
+            value = game.get_tile(row, col)
+            if value:
+                exponent = value.bit_length() - 1
+                assert exponent <= TILE_MASK, \
+                    "tile values must be powers of two up to 32768"
+                board |= exponent << (16 * row + 4 * col)
+    return board
+
+
+class ExpectimaxPlayer:
+    """
+        Expectimax search over packed boards, for any 4 x 4 game
+        with the TwentyFortyEight interface.
+        """
+    
+    def __init__(self, depth=EXPECTIMAX_DEPTH, cutoff=PROBABILITY_CUTOFF,
+                 cache_size=CACHE_SIZE):
+        build_row_tables()
+        build_heuristic_table()
+        self._depth = depth
+        self._cutoff = cutoff
+        self._cache_size = cache_size
+        # board -> (depth searched, value), least recently used first
+        self._cache = OrderedDict()
+        self._nodes = 0
+        self._lookups = 0
+        self._hits = 0
+        self._evictions = 0
+        self._seconds = 0.0
+    
+    def get_stats(self):
+        """
+            Search statistics since the player was created: nodes,
+            nodes per second, cache lookups, hit rate and evictions.
+            """
+        rate = 0.0
+        if self._seconds > 0:
+            rate = self._nodes / self._seconds
+        hit_rate = 0.0
+        if self._lookups:
+            hit_rate = float(self._hits) / self._lookups
+        return {'nodes': self._nodes, 'seconds': self._seconds,
+                'nodes_per_second': rate, 'lookups': self._lookups,
+                'hit_rate': hit_rate, 'evictions': self._evictions,
+                'cache_size': len(self._cache)}
+    
+    def choose_move(self, game):
+        """
+            Best direction for the current position of game, or
+            None when no move changes the board.
+            """
+        start = time.time()
+        board = pack_board(game)
+        best = None
+        best_value = None
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            moved = bitboard_move(board, direction)[0]
+            if moved == board:
+                continue
+            value = self.chance_value(moved, self._depth, 1.0)
+            if best_value == None or value > best_value:
+                best = direction
+                best_value = value
+        self._seconds += time.time() - start
+        return best
+    
+    def play(self, game, max_moves=None):
+        """
+            Play game until no move is left, or for max_moves moves.
+            Returns the number of moves made.
+            """
+        moves = 0
+        while max_moves == None or moves < max_moves:
+            direction = self.choose_move(game)
+            if direction == None:
+                break
+            game.move(direction)
+            moves += 1
+        return moves
+    
+    def evaluate(self, board):
+        """
+            Heuristic value of a packed board.
+            """
+        self._nodes += 1
+        columns = transpose(board)
+        return (ROW_HEURISTIC[board & ROW_MASK] +
+                ROW_HEURISTIC[(board >> 16) & ROW_MASK] +
+                ROW_HEURISTIC[(board >> 32) & ROW_MASK] +
+                ROW_HEURISTIC[board >> 48] +
+                ROW_HEURISTIC[columns & ROW_MASK] +
+                ROW_HEURISTIC[(columns >> 16) & ROW_MASK] +
+                ROW_HEURISTIC[(columns >> 32) & ROW_MASK] +
+                ROW_HEURISTIC[columns >> 48])
+    
+    def max_value(self, board, depth, probability):
+        """
+            Value of the best move from board, 0 when there is none.
+            """
+        self._nodes += 1
+        best = 0.0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            moved = bitboard_move(board, direction)[0]
+            if moved != board:
+                best = max(best, self.chance_value(moved, depth, probability))
+        return best
+    
+    def chance_value(self, board, depth, probability):
+        """
+            Expected value over the new tiles that can appear on
+            board, a 2 with probability 0.9 and a 4 otherwise.
+            """
+        if depth <= 0 or probability < self._cutoff:
+            return self.evaluate(board)
+        self._lookups += 1
+        entry = self._cache.pop(board, None)
+        if entry != None:
+            self._cache[board] = entry
+            if entry[0] >= depth:
+                self._hits += 1
+                return entry[1]
+        self._nodes += 1
+        empty = [shift for shift in range(0, 64, 4) if not (board >> shift) & TILE_MASK]
+        chance = probability / len(empty)
+        total = 0.0
+        for shift in empty:
+            total += 0.9 * self.max_value(board | (1 << shift), depth - 1, chance * 0.9)
+            total += 0.1 * self.max_value(board | (2 << shift), depth - 1, chance * 0.1)
+        value = total / len(empty)
+        self._cache[board] = (depth, value)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+            self._evictions += 1
+        return value
+
+
+def _rollout_task(task):
+    """
+        Worker for MonteCarloPlayer: play count random games from
+        grid, each starting with direction, with tiles drawn from
+        seed, starting none after the deadline if there is one.
+        Returns (direction, total score, games played).
+        """
+    grid, direction, seed, count, max_moves, deadline = task
+    root = TwentyFortyEight(len(grid), len(grid[0]), seed)
+    for row in range(len(grid)):
+        for col in range(len(grid[0])):
+            root.set_tile(row, col, grid[row][col])
+    rng = random.Random(seed)
+    directions = [UP, DOWN, LEFT, RIGHT]
+    total = 0
+    for played in range(count):
+        if deadline != None and time.time() > deadline:
+            return direction, total, played
+        game = root.clone(rng.getrandbits(32))
+        game.move(direction)
+        moves = 1
+        while max_moves == None or moves < max_moves:
+            rng.shuffle(directions)
+            for random_direction in directions:
+                if game.move(random_direction):
+                    break
+            else:
+                break
+            moves += 1
+        total += game.get_score()
+    return direction, total, count
+
+
+class MonteCarloPlayer:
+    """
+        Pure Monte Carlo player: every direction is scored by the
+        mean score of random games that start with it.  Works on
+        TwentyFortyEight games, or any game with clone(seed),
+        get_tile and a move that returns whether the board changed;
+        the rollouts themselves are played on TwentyFortyEight.
+        """
+    
+    def __init__(self, rollouts=MONTE_CARLO_ROLLOUTS, processes=None,
+                 seed=None, time_limit=None, max_moves=None):
+        # processes=0 plays every rollout in this process
+        self._rollouts = rollouts
+        self._processes = processes
+        self._time_limit = time_limit
+        self._max_moves = max_moves
+        self._random = random.Random(seed)
+        self._pool = None
+        self._rollouts_played = 0
+        self._timeouts = 0
+        self._seconds = 0.0
+    
+    def get_stats(self):
+        """
+            Rollouts played, moves cut short by the time limit and
+            rollouts per second since the player was created.
+            """
+        rate = 0.0
+        if self._seconds > 0:
+            rate = self._rollouts_played / self._seconds
+        return {'rollouts': self._rollouts_played, 'timeouts': self._timeouts,
+                'seconds': self._seconds, 'rollouts_per_second': rate}
+    
+    def close(self):
+        """
+            Stop the worker processes, if any were started.
+            """
+        if self._pool != None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+    
+    def choose_move(self, game):
+        """
+            Direction with the best mean rollout score for game, or
+            None when no move changes the board.  With a time limit
+            the best direction found so far is returned once it
+            expires, after every direction has had one rollout.
+            """
+        start = time.time()
+        legal = [direction for direction in (UP, DOWN, LEFT, RIGHT)
+                 if game.clone(0).move(direction)]
+        if not legal:
+            return None
+        grid = [[game.get_tile(row, col) for col in range(game.get_grid_width())]
+                for row in range(game.get_grid_height())]
+        
+        # one rollout per direction comes first and ignores the time
+        # limit, then chunks go round robin over the directions so a
+        # time limit cuts every direction short evenly; seeds are
+        # drawn here so the result does not depend on which worker
+        # plays a chunk
+        deadline = None
+        if self._time_limit != None:
+            deadline = start + self._time_limit
+        tasks = []
+        for direction in legal:
+            tasks.append((grid, direction, self._random.getrandbits(32),
+                          1, self._max_moves, None))
+        for first in range(1, self._rollouts, ROLLOUT_CHUNK):
+            count = min(ROLLOUT_CHUNK, self._rollouts - first)
+            for direction in legal:
+                tasks.append((grid, direction, self._random.getrandbits(32),
+                              count, self._max_moves, deadline))
+        
+        if self._processes != 0 and self._pool == None:
+            self._pool = multiprocessing.Pool(self._processes)
+        if self._pool == None:
+            batch_size = 1
+        else:
+            batch_size = max(len(legal), self._processes or multiprocessing.cpu_count())
+        
+        totals = dict((direction, [0, 0]) for direction in legal)
+        played = 0
+        for first in range(0, len(tasks), batch_size):
+            if (deadline != None and first >= len(legal) and
+                    time.time() > deadline):
+                break
+            batch = tasks[first:first + batch_size]
+            if self._pool == None:
+                results = [_rollout_task(task) for task in batch]
+            else:
+                results = self._pool.map(_rollout_task, batch)
+            for direction, total, count in results:
+                totals[direction][0] += total
+                totals[direction][1] += count
+                played += count
+        self._rollouts_played += played
+        if played < len(legal) * self._rollouts:
+            self._timeouts += 1
+        
+        best = None
+        best_mean = None
+        for direction in legal:
+            total, count = totals[direction]
+            if count == 0:
+                continue
+            mean = float(total) / count
+            if best_mean == None or mean > best_mean:
+                best = direction
+                best_mean = mean
+        self._seconds += time.time() - start
+        return best
+    
+    def play(self, game, max_moves=None):
+        """
+            Play game until no move is left, or for max_moves moves.
+            Returns the number of moves made.
+            """
+        moves = 0
+        while max_moves == None or moves < max_moves:
+            direction = self.choose_move(game)
+            if direction == None:
+                break
+            game.move(direction)
+            moves += 1
+        return moves
+
+
+def pack_exponents(game):
+    """
+        One byte tile exponent per cell of game, row by row.
+        """
+    cells = []
+    for row in range(game.get_grid_height()):
+        for col in range(game.get_grid_width()):
+            value = game.get_tile(row, col)
+            if value:
+                cells.append(value.bit_length() - 1)
+            else:
+                cells.append(0)
+    return struct.pack("%dB" % len(cells), *cells)
+
+
+class GameRecorder:
+    """
+        Plays moves on a TwentyFortyEight game and streams them to
+        a binary recording, one game per stream.
+        """
+    
+    def __init__(self, game, stream, interval=KEYFRAME_INTERVAL):
+        height = game.get_grid_height()
+        width = game.get_grid_width()
+        assert height * width <= 256, "spawn positions must fit in a byte"
+        self._game = game
+        self._stream = stream
+        self._interval = interval
+        self._moves = 0
+        stream.write(struct.pack(RECORD_HEADER, RECORD_MAGIC, height, width, interval))
+        self.write_keyframe()
+    
+    def get_moves(self):
+        """
+            Number of moves recorded so far.
+            """
+        return self._moves
+    
+    def write_keyframe(self):
+        """
+            Snapshot of the game before the next move.
+            """
+        self._stream.write(struct.pack(KEYFRAME_HEADER, self._moves,
+                                       self._game.get_score()))
+        self._stream.write(pack_exponents(self._game))
+    
+    def move(self, direction):
+        """
+            Move the game and record the move and its new tile.
+            Moves that do not change the board are not recorded.
+            Returns True when the board changed.
+            """
+        # a new block starts with a snapshot of the board, written
+        # only if the move will actually be recorded
+        if self._moves and self._moves % self._interval == 0:
+            if self._game.clone(0).shift_tiles(direction):
+                self.write_keyframe()
+        if not self._game.move(direction):
+            return False
+        self._stream.write(pack_record(direction, self._game.get_last_spawn(),
+                                       self._game.get_grid_width()))
+        self._moves += 1
+        return True
+
+
+def pack_record(direction, spawn, width):
+    """
+        Two byte record of a move in direction that added the tile
+        spawn, a (row, col, value) triple or None.
+        """
+    if spawn == None:
+        return struct.pack("BB", direction, 0)
+    row, col, value = spawn
+    flags = SPAWNED
+    if value == 4:
+        flags |= SPAWN_FOUR
+    return struct.pack("BB", direction | flags, row * width + col)
+
+
+def unpack_record(record, width):
+    """
+        direction and new tile (row, col, value) of a two byte
+        record, the tile being None when no tile was added.
+        """
+    flags, cell = struct.unpack("BB", record)
+    if not flags & SPAWNED:
+        return flags & 7, None
+    value = 2
+    if flags & SPAWN_FOUR:
+        value = 4
+    return flags & 7, (cell // width, cell % width, value)
+
+
+class GameReader:
+    """
+        Reads a recording made by GameRecorder.  Moves stream in
+        order from any file; board_at seeks to the nearest keyframe
+        and needs a seekable one.
+        """
+    
+    def __init__(self, stream):
+        self._stream = stream
+        header = stream.read(struct.calcsize(RECORD_HEADER))
+        magic, height, width, interval = struct.unpack(RECORD_HEADER, header)
+        assert magic == RECORD_MAGIC, "not a game recording"
+        self._start = stream.tell()
+        self._height = height
+        self._width = width
+        self._interval = interval
+        self._keyframe_size = struct.calcsize(KEYFRAME_HEADER) + height * width
+        self._block_size = self._keyframe_size + 2 * interval
+    
+    def get_grid_height(self):
+        """
+            Height of the recorded game.
+            """
+        return self._height
+    
+    def get_grid_width(self):
+        """
+            Width of the recorded game.
+            """
+        return self._width
+    
+    def get_move_count(self):
+        """
+            Number of moves in the recording.
+            """
+        self._stream.seek(0, 2)
+        size = self._stream.tell() - self._start
+        blocks, rest = divmod(size, self._block_size)
+        if rest == 0:
+            return blocks * self._interval
+        return blocks * self._interval + (rest - self._keyframe_size) // 2
+    
+    def read_keyframe(self):
+        """
+            game restored from the keyframe at the stream position,
+            with its move number.
+            """
+        header = self._stream.read(struct.calcsize(KEYFRAME_HEADER))
+        moves, score = struct.unpack(KEYFRAME_HEADER, header)
+        cells = struct.unpack("%dB" % (self._height * self._width),
+                              self._stream.read(self._height * self._width))
+        game = TwentyFortyEight(self._height, self._width)
+        for index in range(len(cells)):
+            value = 0
+            if cells[index]:
+                value = 1 << cells[index]
+            game.set_tile(index // self._width, index % self._width, value)
+        game.set_score(score)
+        return game, moves
+    
+    def moves(self):
+        """
+            Generate the (direction, new tile) of every move in
+            order, reading the stream front to back.
+            """
+        self._stream.seek(self._start)
+        while True:
+            keyframe = self._stream.read(self._keyframe_size)
+            if len(keyframe) < self._keyframe_size:
+                return
+            records = self._stream.read(2 * self._interval)
+            for first in range(0, len(records) - 1, 2):
+                yield unpack_record(records[first:first + 2], self._width)
+    
+    def board_at(self, move):
+        """
+            game after the given number of moves, replayed from the
+            nearest keyframe at or before it.
+            """
+        assert 0 <= move <= self.get_move_count(), "move out of range"
+        block = move // self._interval
+        if block and move == self.get_move_count() and move % self._interval == 0:
+            # the last block is full, so there is no keyframe after it
+            block -= 1
+        self._stream.seek(self._start + block * self._block_size)
+        game, moves = self.read_keyframe()
+        records = self._stream.read(2 * (move - moves))
+        for first in range(0, len(records), 2):
+            direction, spawn = unpack_record(records[first:first + 2], self._width)
+            replay_move(game, direction, spawn)
+        return game
+
+
+def replay_move(game, direction, spawn):
+    """
+        Apply a recorded move and its new tile to game.
+        """
+    game.shift_tiles(direction)
+    if spawn != None:
+        game.set_tile(spawn[0], spawn[1], spawn[2])
+
+
+def line_indices(shape, direction):
+    """
+        Flat indices of every line of a board of the given shape,
+        each ordered from the side direction moves tiles toward,
+        with an itemgetter that gathers the line.  Cached per
+        shape and direction.
+        """
+    key = (shape, direction)
+    lines = LINE_INDICES.get(key)
+    if lines != None:
+        return lines
+    axis, toward_start = direction
+    strides = [1] * len(shape)
+    for dim in range(len(shape) - 2, -1, -1):
+        strides[dim] = strides[dim + 1] * shape[dim + 1]
+    
+    # the start of every line is a cell with coordinate 0 on axis
+    starts = [0]
+    for dim in range(len(shape)):
+        if dim != axis:
+            starts = [start + step * strides[dim] for start in starts
+                      for step in range(shape[dim])]
+    lines = []
+    for start in sorted(starts):
+        line = [start + step * strides[axis] for step in range(shape[axis])]
+        if not toward_start:
+            line.reverse()
+        # itemgetter of a single index returns a bare value
+        if len(line) > 1:
+            lines.append((line, itemgetter(*line)))
+        else:
+            lines.append((line, lambda cells, index=line[0]: (cells[index],)))
+    LINE_INDICES[key] = lines
+    return lines
+
+
+class FlatTwentyFortyEight:
+    """
+        2048 on a board of any shape and number of dimensions,
+        stored as one flat list.  Moves gather each line with
+        cached indices and scatter back only changed lines.
+        """
+    
+    def __init__(self, shape, seed=None):
+        self._shape = tuple(shape)
+        self._size = 1
+        for length in self._shape:
+            self._size *= length
+        self._random = random.Random(seed)
+        self.reset()
+    
+    def reset(self):
+        """
+            Reset the game so the board is empty except for two
+            initial tiles.
+            """
+        self._cells = [0] * self._size
+        self._score = 0
+        # empty cells and their positions in _empty, kept up to date
+        # as cells fill and empty so new_tile never scans the board
+        self._empty = range(self._size)
+        self._empty_index = dict((index, index) for index in range(self._size))
+        self.new_tile()
+        self.new_tile()
+    
+    def __str__(self):
+        """
+            Return the board as nested lists, one level per axis.
+            """
+        rows = self._cells
+        for length in reversed(self._shape[1:]):
+            rows = [rows[first:first + length] for first in range(0, len(rows), length)]
+        return str(rows)
+    
+    def get_shape(self):
+        """
+            Get the length of the board along each axis.
+            """
+        return self._shape
+    
+    def get_grid_height(self):
+        """
+            Get the height of a 2-D board.
+            """
+        return self._shape[0]
+    
+    def get_grid_width(self):
+        """
+            Get the width of a 2-D board.
+            """
+        return self._shape[1]
+    
+    def get_cells(self):
+        """
+            Get a copy of the flat board, row major.
+            """
+        return list(self._cells)
+    
+    def get_score(self):
+        """
+            Get the sum of the tiles made by merges so far.
+            """
+        return self._score
+    
+    def flat_index(self, coords):
+        """
+            Flat index of the cell at the given coordinates.
+            """
+        index = 0
+        for dim in range(len(self._shape)):
+            index = index * self._shape[dim] + coords[dim]
+        return index
+    
+    def get_value(self, coords):
+        """
+            Value of the tile at the given coordinates.
+            """
+        return self._cells[self.flat_index(coords)]
+    
+    def set_value(self, coords, value):
+        """
+            Set the tile at the given coordinates.
+            """
+        self.set_cell(self.flat_index(coords), value)
+    
+    def get_tile(self, row, col):
+        """
+            Return the value of the tile at position row, col.
+            """
+        return self._cells[row * self._shape[1] + col]
+    
+    def set_tile(self, row, col, value):
+        """
+            Set the tile at position row, col to have the given value.
+            """
+        self.set_cell(row * self._shape[1] + col, value)
+    
+    def get_empty_count(self):
+        """
+            Number of empty cells.
+            """
+        return len(self._empty)
+    
+    def set_cell(self, index, value):
+        """
+            Set the tile at a flat index, keeping the empty cell
+            list in step.
+            """
+        old_value = self._cells[index]
+        self._cells[index] = value
+        if old_value == 0 and value != 0:
+            self.fill_cell(index)
+        elif old_value != 0 and value == 0:
+            self.free_cell(index)
+    
+    def fill_cell(self, index):
+        """
+            Take a newly filled cell out of the empty cell list.
+            """
+        position = self._empty_index.pop(index)
+        last = self._empty.pop()
+        if position < len(self._empty):
+            self._empty[position] = last
+            self._empty_index[last] = position
+    
+    def free_cell(self, index):
+        """
+            Add a newly emptied cell to the empty cell list.
+            """
+        self._empty_index[index] = len(self._empty)
+        self._empty.append(index)
+    
+    def shift_tiles(self, direction):
+        """
+            Move all tiles in direction, UP to RIGHT or an (axis,
+            toward start) pair, without adding a new tile.  Returns
+            True when the board changed.
+            """
+        direction = FLAT_DIRECTIONS.get(direction, direction)
+        cells = self._cells
+        out = [0] * self._shape[direction[0]]
+        changed = False
+        for line, gather in line_indices(self._shape, direction):
+            score, line_changed = merge_into(gather(cells), out)
+            if line_changed:
+                changed = True
+                self._score += score
+                for index, value in zip(line, out):
+                    old_value = cells[index]
+                    if old_value != value:
+                        cells[index] = value
+                        if old_value == 0:
+                            self.fill_cell(index)
+                        elif value == 0:
+                            self.free_cell(index)
+        return changed
+    
+    def move(self, direction):
+        """
+            Move all tiles in direction and add a new tile if any
+            tiles moved.  Returns True when the board changed.
+            """
+        changed = self.shift_tiles(direction)
+        if changed:
+            self.new_tile()
+        return changed
+    
+    def new_tile(self):
+        """
+            Create a 2 (90%) or 4 (10%) in a random empty cell.
+            Does nothing on a full board.
+            """
+        if not self._empty:
+            return
+        index = self._empty[self._random.randrange(len(self._empty))]
+        if self._random.randint(0, 9) == 9:
+            self.set_cell(index, 4)
+        else:
+            self.set_cell(index, 2)
+
+
+def benchmark_engines(sizes=BENCHMARK_SIZES, moves=200, seed=0):
+    """
+        Time TwentyFortyEight and FlatTwentyFortyEight on the same
+        random size x size boards, first sliding without new tiles,
+        checking both reach the same boards, then making full moves
+        with new tiles.  Returns a list of dictionaries of seconds
+        per slide and per move.
+        """
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        values = [rng.choice((0, 0, 2, 2, 4, 8)) for dummy in range(size * size)]
+        directions = [rng.choice((UP, DOWN, LEFT, RIGHT)) for dummy in range(moves)]
+        result = {'size': size}
+        for method in ('shift_tiles', 'move'):
+            boards = []
+            for engine in (TwentyFortyEight(size, size, seed),
+                           FlatTwentyFortyEight((size, size), seed)):
+                for index in range(size * size):
+                    engine.set_tile(index // size, index % size, values[index])
+                play = getattr(engine, method)
+                start = time.time()
+                for direction in directions:
+                    play(direction)
+                seconds = (time.time() - start) / moves
+                boards.append(str(engine))
+                if isinstance(engine, TwentyFortyEight):
+                    result['grid_' + method] = seconds
+                else:
+                    result['flat_' + method] = seconds
+            if method == 'shift_tiles':
+                assert boards[0] == boards[1], "engines disagree"
+        result['speedup'] = result['grid_move'] / max(result['flat_move'], 1e-9)
+        results.append(result)
+    return results
+
+
+def orient(boards, direction):
+    """
+        view of an (n, height, width) array in which the given
+        direction moves tiles towards column 0
+        """
+    if direction == LEFT:
+        return boards
+    elif direction == RIGHT:
+        return boards[:, :, ::-1]
+    elif direction == UP:
+        return boards.transpose(0, 2, 1)
+    return boards.transpose(0, 2, 1)[:, :, ::-1]
+
+
+def compact(lines):
+    """
+        slide the non-zero tiles of each line to the front,
+        keeping their order
+        """
+    order = numpy.argsort(lines == 0, axis=1, kind="mergesort")
+    return numpy.take_along_axis(lines, order, axis=1)
+
+
+def batch_move(boards, direction):
+    """
+        Move an (n, height, width) array of tile exponents in the
+        given direction with the semantics of merge, without adding
+        tiles. Returns the new boards and the score of each board.
+        """
+    oriented = orient(boards, direction)
+    count, rows, length = oriented.shape
+    lines = compact(oriented.reshape(count * rows, length))
+    scores = numpy.zeros(count * rows, dtype=numpy.int64)
+    for col in range(length - 1):
+        pair = (lines[:, col] != 0) & (lines[:, col] == lines[:, col + 1])
+        lines[pair, col] += 1
+        lines[pair, col + 1] = 0
+        scores += numpy.where(pair, numpy.left_shift(1, lines[:, col].astype(numpy.int64)), 0)
+    moved = numpy.empty_like(boards)
+    orient(moved, direction)[...] = compact(lines).reshape(count, rows, length)
+    return moved, scores.reshape(count, rows).sum(axis=1)
+
+
+class BatchTwentyFortyEight:
+    """
+        Many games of the same size played at once, held as one
+        numpy array of tile exponents (0 for an empty cell).
+        """
+    
+    def __init__(self, games, grid_height=4, grid_width=4, seed=None):
+        assert numpy != None, "the batch simulator needs numpy"
+        self._random = numpy.random.RandomState(seed)
+        self._boards = numpy.zeros((games, grid_height, grid_width), dtype=numpy.uint8)
+        self._scores = numpy.zeros(games, dtype=numpy.int64)
+        self._moves = numpy.zeros(games, dtype=numpy.int64)
+        self.reset()
+    
+    def reset(self):
+        """
+            Reset every game to an empty grid with two tiles.
+            """
+        self._boards[...] = 0
+        self._scores[...] = 0
+        self._moves[...] = 0
+        everyone = numpy.ones(len(self._boards), dtype=bool)
+        self.new_tiles(everyone)
+        self.new_tiles(everyone)
+    
+    def get_boards(self):
+        """
+            Tile values of every game as an (n, height, width) array.
+            """
+        values = numpy.left_shift(1, self._boards.astype(numpy.int64))
+        values[self._boards == 0] = 0
+        return values
+    
+    def get_exponents(self):
+        """
+            Copy of the tile exponents of every game.
+            """
+        return self._boards.copy()
+    
+    def get_scores(self):
+        """
+            Total merge score of every game.
+            """
+        return self._scores.copy()
+    
+    def new_tiles(self, games):
+        """
+            Add a tile to a random empty cell of every game selected
+            by the boolean array games; 2 90% of the time, else 4.
+            """
+        cells = self._boards.reshape(len(self._boards), -1)
+        empty = cells == 0
+        keys = self._random.random_sample(cells.shape)
+        keys[~empty] = -1.0
+        chosen = numpy.nonzero(games & empty.any(axis=1))[0]
+        values = numpy.where(self._random.random_sample(len(chosen)) < 0.9, 1, 2)
+        cells[chosen, keys[chosen].argmax(axis=1)] = values
+    
+    def legal_moves(self):
+        """
+            Moved boards and scores for every direction of
+            BATCH_DIRECTIONS, and an (n, 4) array telling which
+            directions change each board.
+            """
+        moved = []
+        scores = []
+        for direction in BATCH_DIRECTIONS:
+            boards, score = batch_move(self._boards, direction)
+            moved.append(boards)
+            scores.append(score)
+        moved = numpy.array(moved)
+        legal = (moved != self._boards[numpy.newaxis]).any(axis=(2, 3)).T
+        return moved, numpy.array(scores), legal
+    
+    def step(self, choices, moves=None):
+        """
+            Move every game in the direction indexed by choices into
+            BATCH_DIRECTIONS, adding a tile to the games that changed.
+            Games given a negative choice are left alone.  moves is
+            the result of legal_moves for the current boards, when
+            the caller already has it.
+            """
+        if moves == None:
+            moves = self.legal_moves()
+        moved, scores, legal = moves
+        games = numpy.arange(len(self._boards))
+        playing = choices >= 0
+        picks = numpy.where(playing, choices, 0)
+        changed = playing & legal[games, picks]
+        self._boards[changed] = moved[picks, games][changed]
+        self._scores[changed] += scores[picks, games][changed]
+        self._moves[changed] += 1
+        self.new_tiles(changed)
+        return changed
+    
+    def run(self, policy=None, max_moves=None):
+        """
+            Play every game until it has no legal move or has made
+            max_moves moves. policy(exponents, legal, random_state)
+            returns an index into BATCH_DIRECTIONS per game and
+            defaults to a uniformly random legal move.
+            Returns a dictionary of per-game scores, max tiles and
+            move counts.
+            """
+        games = numpy.arange(len(self._boards))
+        while True:
+            moves = self.legal_moves()
+            legal = moves[2].copy()
+            if max_moves != None:
+                legal &= (self._moves < max_moves)[:, numpy.newaxis]
+            playing = legal.any(axis=1)
+            if not playing.any():
+                break
+            keys = self._random.random_sample(legal.shape)
+            keys[~legal] = -1.0
+            choices = keys.argmax(axis=1)
+            if policy != None:
+                # a choice that is out of range or does not change its
+                # board is replaced by the random legal move, so a bad
+                # policy cannot stall a game forever
+                picks = numpy.asarray(policy(self._boards.copy(), legal, self._random))
+                valid = (picks >= 0) & (picks < len(BATCH_DIRECTIONS))
+                valid[valid] &= legal[games[valid], picks[valid]]
+                choices = numpy.where(valid, picks, choices)
+            self.step(numpy.where(playing, choices, -1), moves)
+        top = self._boards.reshape(len(self._boards), -1).max(axis=1).astype(numpy.int64)
+        return {'scores': self._scores.copy(),
+                'max_tiles': numpy.where(top > 0, numpy.left_shift(1, top), 0),
+                'moves': self._moves.copy()}
+
+
 poc_2048_gui.run_gui(TwentyFortyEight(4, 5))
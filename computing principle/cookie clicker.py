@@ -3,16 +3,484 @@
     """
 
 import simpleplot
+import csv
+import heapq
 import math
+import multiprocessing
+import struct
+import time as timer
+from array import array
+from bisect import bisect_left, bisect_right, insort
 # Used to increase the timeout, if necessary
 import codeskulptor
 codeskulptor.set_timeout(20)
 
 import poc_clicker_provided as provided
 
+# numpy is only needed to evaluate cookie curves in bulk
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Constants
 SIM_TIME = 10000000000.0
 
+# histories longer than this are shortened by ClickerState.__str__
+STR_HISTORY_LENGTH = 10
+
+# strategy_best: purchases planned ahead, and the items with the
+# shortest payback considered at each step of the plan
+BEST_LOOKAHEAD = 2
+BEST_CANDIDATES = 4
+
+# tournament: durations played by default, and results kept by
+# (strategy, parameters, BuildInfo fingerprint, duration)
+TOURNAMENT_DURATIONS = (1000000.0, 100000000.0, SIM_TIME)
+TOURNAMENT_CACHE = {}
+
+# binary history export: magic, number of entries and of item names
+HISTORY_MAGIC = "CLH1"
+HISTORY_HEADER = "<4sII"
+
+class HistoryView:
+    """
+        Read-only view of a history or of one of its columns,
+        handed to strategies instead of a copy.
+        """
+    
+    def __init__(self, history):
+        """
+            wrap the history without copying it
+            """
+        self._history = history
+    
+    def __len__(self):
+        """
+            number of history entries
+            """
+        return len(self._history)
+    
+    def __getitem__(self, index):
+        """
+            history entry or slice at index
+            """
+        return self._history[index]
+    
+    def __iter__(self):
+        """
+            iterate over the history entries
+            """
+        return iter(self._history)
+
+
+class ClickerHistory:
+    """
+        Purchase history stored by column: arrays of times, costs
+        and total cookies, and item names interned to ids.
+        Indexing and iterating give (time, item, cost of item,
+        total cookies) tuples.
+        """
+    
+    def __init__(self):
+        """
+            start an empty history
+            """
+        self._times = array('d')
+        self._costs = array('d')
+        self._totals = array('d')
+        self._items = array('H')
+        # item id 0 is None, the entry made when the game starts
+        self._item_names = [None]
+        self._item_ids = {None: 0}
+    
+    def append(self, time, item, cost, total):
+        """
+            add a purchase at the end of the history
+            """
+        item_id = self._item_ids.get(item)
+        if item_id == None:
+            item_id = len(self._item_names)
+            self._item_ids[item] = item_id
+            self._item_names.append(item)
+        self._times.append(time)
+        self._costs.append(cost)
+        self._totals.append(total)
+        self._items.append(item_id)
+    
+    def extend(self, time, item, costs, total):
+        """
+            add purchases of the same item at the same time, one
+            per cost, at the end of the history
+            """
+        self.append(time, item, costs[0], total)
+        rest = len(costs) - 1
+        self._times.extend([time] * rest)
+        self._costs.extend(costs[1:])
+        self._totals.extend([total] * rest)
+        self._items.extend([self._items[-1]] * rest)
+    
+    def __len__(self):
+        """
+            number of history entries
+            """
+        return len(self._times)
+    
+    def __getitem__(self, index):
+        """
+            history tuple at index, or a list of them for a slice
+            """
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        return (self._times[index], self._item_names[self._items[index]],
+                self._costs[index], self._totals[index])
+    
+    def __iter__(self):
+        """
+            iterate over the history tuples
+            """
+        names = self._item_names
+        for index in range(len(self._times)):
+            yield (self._times[index], names[self._items[index]],
+                   self._costs[index], self._totals[index])
+    
+    def to_list(self):
+        """
+            list of the history tuples, built a column at a time
+            """
+        return zip(self._times, map(self._item_names.__getitem__, self._items),
+                   self._costs, self._totals)
+    
+    def get_times(self):
+        """
+            read-only view of the purchase times
+            """
+        return HistoryView(self._times)
+    
+    def get_costs(self):
+        """
+            read-only view of the purchase costs
+            """
+        return HistoryView(self._costs)
+    
+    def get_totals(self):
+        """
+            read-only view of the total cookies at each purchase
+            """
+        return HistoryView(self._totals)
+    
+    def get_items(self):
+        """
+            list of the purchased item names, in order
+            """
+        names = self._item_names
+        return [names[item_id] for item_id in self._items]
+    
+    def get_buffer(self, column):
+        """
+            zero copy read-only buffer of the native doubles of the
+            'time', 'cost' or 'total' column, for numpy.frombuffer
+            """
+        data = {'time': self._times, 'cost': self._costs, 'total': self._totals}[column]
+        try:
+            return memoryview(data)
+        except TypeError:
+            # arrays only have the old buffer interface in python 2
+            return buffer(data)
+    
+    def downsample(self, points):
+        """
+            at most points history tuples spread evenly over the
+            history, always keeping the first and last entries
+            """
+        length = len(self)
+        if length <= points:
+            return list(self)
+        if points < 2:
+            return [self[length - 1]][:points]
+        step = float(length - 1) / (points - 1)
+        return [self[int(round(index * step))] for index in range(points)]
+    
+    def export_csv(self, stream):
+        """
+            write the history to stream as csv with a header row
+            """
+        writer = csv.writer(stream)
+        writer.writerow(('time', 'item', 'cost', 'total cookies'))
+        for time, item, cost, total in self:
+            writer.writerow((repr(time), item or '', repr(cost), repr(total)))
+    
+    def export_binary(self, stream):
+        """
+            write the history to stream as a header, the item names
+            and the raw columns, readable by load_history
+            """
+        stream.write(struct.pack(HISTORY_HEADER, HISTORY_MAGIC, len(self),
+                                 len(self._item_names) - 1))
+        for name in self._item_names[1:]:
+            encoded = name.encode('utf-8')
+            stream.write(struct.pack("<H", len(encoded)) + encoded)
+        for column in (self._times, self._costs, self._totals, self._items):
+            stream.write(column.tostring())
+
+
+def load_history(stream):
+    """
+        Read a history written by ClickerHistory.export_binary.
+        Returns a ClickerHistory object.
+        """
+    header = stream.read(struct.calcsize(HISTORY_HEADER))
+    magic, length, names = struct.unpack(HISTORY_HEADER, header)
+    assert magic == HISTORY_MAGIC, "not a clicker history"
+    history = ClickerHistory()
+    for dummy in range(names):
+        size = struct.unpack("<H", stream.read(2))[0]
+        name = stream.read(size).decode('utf-8')
+        history._item_ids[name] = len(history._item_names)
+        history._item_names.append(name)
+    for column in (history._times, history._costs, history._totals, history._items):
+        column.fromstring(stream.read(length * column.itemsize))
+        assert len(column) == length, "truncated clicker history"
+    return history
+
+
+class CookieCurve:
+    """
+        Total cookies as a piecewise linear function of time,
+        with a knot at every distinct purchase time.  The slope
+        of each piece is the CPS between two purchases, worked out
+        from the totals, and after the last purchase the final CPS.
+        """
+    
+    def __init__(self, times, totals, final_cps):
+        """
+            build the curve from purchase times and the matching
+            total cookies, nondecreasing, and the CPS after them
+            """
+        self._times = []
+        self._totals = []
+        for time, total in zip(times, totals):
+            # purchases at the same time leave the total unchanged
+            if self._times and time == self._times[-1]:
+                continue
+            self._times.append(time)
+            self._totals.append(total)
+        self._slopes = []
+        for index in range(len(self._times) - 1):
+            self._slopes.append((self._totals[index + 1] - self._totals[index]) /
+                                (self._times[index + 1] - self._times[index]))
+        self._slopes.append(final_cps)
+    
+    def get_times(self):
+        """
+            list of the knot times
+            """
+        return list(self._times)
+    
+    def total_at(self, time):
+        """
+            total cookies made by time, extrapolated past the last
+            purchase at the final CPS; times before the first knot
+            give its total
+            """
+        if time <= self._times[0]:
+            return self._totals[0]
+        index = bisect_right(self._times, time) - 1
+        return self._totals[index] + self._slopes[index] * (time - self._times[index])
+    
+    def time_to_reach(self, total):
+        """
+            first time the total cookies reach total, or None if the
+            curve never gets there; totals already reached at the
+            first knot give its time
+            """
+        if total <= self._totals[0]:
+            return self._times[0]
+        index = bisect_left(self._totals, total)
+        if index < len(self._totals) and self._totals[index] == total:
+            return self._times[index]
+        index = max(index - 1, 0)
+        if self._slopes[index] <= 0:
+            return None
+        return self._times[index] + (total - self._totals[index]) / self._slopes[index]
+    
+    def totals_at(self, times):
+        """
+            total_at for a sequence of times, as a numpy array when
+            numpy is available and a list otherwise
+            """
+        if numpy == None:
+            return [self.total_at(time) for time in times]
+        times = numpy.maximum(numpy.asarray(times, dtype=float), self._times[0])
+        index = numpy.searchsorted(self._times, times, 'right') - 1
+        return (numpy.asarray(self._totals)[index] + numpy.asarray(self._slopes)[index] *
+                (times - numpy.asarray(self._times)[index]))
+    
+    def times_to_reach(self, totals):
+        """
+            time_to_reach for a sequence of totals, as a numpy array
+            with nan for unreachable totals when numpy is available
+            and a list otherwise
+            """
+        if numpy == None:
+            return [self.time_to_reach(total) for total in totals]
+        knots = numpy.asarray(self._totals)
+        totals = numpy.maximum(numpy.asarray(totals, dtype=float), knots[0])
+        index = numpy.searchsorted(knots, totals, 'left')
+        exact = numpy.minimum(index, len(knots) - 1)
+        hit = knots[exact] == totals
+        index = numpy.where(hit, exact, numpy.maximum(index - 1, 0))
+        slopes = numpy.asarray(self._slopes)[index]
+        start = numpy.asarray(self._times)[index]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            result = numpy.where(hit, start, start + (totals - knots[index]) / slopes)
+        return numpy.where(hit | (slopes > 0), result, numpy.nan)
+
+
+def cost_growth(build_info):
+    """
+        Factor by which update_item grows an item's cost, the same
+        for every item of a BuildInfo, read off one update of a
+        clone (1.0 without items)
+        """
+    if isinstance(build_info, IndexedBuildInfo):
+        return build_info.get_growth()
+    items = build_info.build_items()
+    if not items:
+        return 1.0
+    probe = build_info.clone()
+    probe.update_item(items[0])
+    return probe.get_cost(items[0]) / build_info.get_cost(items[0])
+
+
+class IndexedBuildInfo:
+    """
+        BuildInfo wrapper that keeps the items sorted by cost and a
+        heap of them by cost over CPS, so strategies can ask for the
+        cheapest, the most expensive affordable and the best ratio
+        item without scanning every item.
+        """
+    
+    def __init__(self, build_info):
+        """
+            index the items of build_info, which is then updated
+            through this wrapper only
+            """
+        self._info = build_info
+        self._items = build_info.build_items()
+        # ties go to the item listed first, as in a scan of the items
+        self._order = dict((item, index) for index, item in enumerate(self._items))
+        self._by_cost = sorted((build_info.get_cost(item), self._order[item], item)
+                               for item in self._items)
+        self._by_ratio = []
+        for item in self._items:
+            self.push_ratio(item)
+        self._growth = None
+    
+    def get_growth(self):
+        """
+            cost growth of the wrapped build info, worked out once
+            """
+        if self._growth == None:
+            self._growth = cost_growth(self._info)
+        return self._growth
+    
+    def build_items(self):
+        """
+            list of the item names
+            """
+        return list(self._items)
+    
+    def get_cost(self, item):
+        """
+            current cost of item
+            """
+        return self._info.get_cost(item)
+    
+    def get_cps(self, item):
+        """
+            CPS added by item
+            """
+        return self._info.get_cps(item)
+    
+    def clone(self):
+        """
+            indexed copy of the build info
+            """
+        return IndexedBuildInfo(self._info.clone())
+    
+    def push_ratio(self, item):
+        """
+            add item to the ratio heap at its current cost
+            """
+        cps = self._info.get_cps(item)
+        if cps > 0:
+            heapq.heappush(self._by_ratio, (self._info.get_cost(item) / cps,
+                                            self._order[item], item))
+    
+    def update_item(self, item, count=1):
+        """
+            update the cost of item after count purchases and move
+            it in the indexes once; the old ratio entry is dropped
+            lazily
+            """
+        cost = self._info.get_cost(item)
+        del self._by_cost[bisect_left(self._by_cost, (cost, self._order[item], item))]
+        for dummy in range(count):
+            self._info.update_item(item)
+        insort(self._by_cost, (self._info.get_cost(item), self._order[item], item))
+        self.push_ratio(item)
+        # stale entries accumulate in the heap, so rebuild it now and then
+        if len(self._by_ratio) > 4 * len(self._items):
+            self._by_ratio = []
+            for name in self._items:
+                self.push_ratio(name)
+    
+    def cheapest(self):
+        """
+            (cost, item) of the cheapest item, or None without items
+            """
+        if not self._by_cost:
+            return None
+        return self._by_cost[0][0], self._by_cost[0][2]
+    
+    def most_expensive(self, limit=None):
+        """
+            (cost, item) of the most expensive item costing less
+            than limit (any cost when limit is None), or None
+            """
+        if limit == None:
+            index = len(self._by_cost) - 1
+        else:
+            index = bisect_left(self._by_cost, (limit,)) - 1
+        if index < 0:
+            return None
+        cost = self._by_cost[index][0]
+        # the first listed of the items sharing that cost
+        index = bisect_left(self._by_cost, (cost,))
+        return cost, self._by_cost[index][2]
+    
+    def items_costing(self, cost):
+        """
+            list of the items costing exactly cost, in listed order
+            """
+        first = bisect_left(self._by_cost, (cost,))
+        last = bisect_left(self._by_cost, (cost, len(self._items)))
+        return [entry[2] for entry in self._by_cost[first:last]]
+    
+    def best_ratio(self):
+        """
+            (cost over CPS, item) of the item with the lowest ratio,
+            or None if no item adds CPS
+            """
+        while self._by_ratio:
+            ratio, dummy, item = self._by_ratio[0]
+            if ratio == self._info.get_cost(item) / self._info.get_cps(item):
+                return ratio, item
+            heapq.heappop(self._by_ratio)
+        return None
+
+
 class ClickerState:
     """
         Simple class to keep track of the game state.
@@ -26,16 +494,32 @@ class ClickerState:
         self._current_time = 0.0
         self._current_cookies = 0.0
         self._current_cps = 1.0
-        self._history = [(0.0, None, 0.0, 0.0)]
+        self._history = ClickerHistory()
+        self._history.append(0.0, None, 0.0, 0.0)
     
     def __str__(self):
         """
             Return human readable state
             """
-        dummy = 'total cookies: ' + str(self._total_cookies) + '\n' + 'current cookies: ' + str(self._current_cookies) +'\n'+ 'current_cps: ' + str(self._current_cps) + '\n'+ str(len(self._history)) + str(self._history)
+        # long histories show only their first and last entries
+        if len(self._history) <= STR_HISTORY_LENGTH:
+            history = str(list(self._history))
+        else:
+            half = STR_HISTORY_LENGTH // 2
+            history = (str(self._history[:half])[:-1] + ', ..., ' +
+                       str(self._history[-half:])[1:])
+        dummy = 'total cookies: ' + str(self._total_cookies) + '\n' + 'current cookies: ' + str(self._current_cookies) +'\n'+ 'current_cps: ' + str(self._current_cps) + '\n'+ str(len(self._history)) + history
         
         return dummy
     
+    def get_total_cookies(self):
+        """
+            Return the total number of cookies made so far
+            
+            Should return a float
+            """
+        return self._total_cookies
+    
     def get_cookies(self):
         """
             Return current number of cookies
@@ -73,7 +557,29 @@ class ClickerState:
             Should return a copy of any internal data structures,
             so that they will not be modified outside of the class.
             """
-        return list(self._history)
+        return self._history.to_list()
+    
+    def get_history_view(self):
+        """
+            Return a read-only view of the history that follows
+            later purchases without copying
+            """
+        return HistoryView(self._history)
+    
+    def get_history_store(self):
+        """
+            Return the columnar history itself, for column views,
+            downsampling and export; callers must not append to it
+            """
+        return self._history
+    
+    def get_cookie_curve(self):
+        """
+            Return a CookieCurve of the total cookies over time up
+            to now, continuing at the current CPS
+            """
+        return CookieCurve(self._history.get_times(), self._history.get_totals(),
+                           self._current_cps)
     
     def time_until(self, cookies):
         """
@@ -109,7 +615,27 @@ class ClickerState:
         if cost <= self._current_cookies:
             self._current_cookies -= cost
             self._current_cps += additional_cps
-            self._history.append((self._current_time, item_name, cost, self._total_cookies))
+            self._history.append(self._current_time, item_name, cost, self._total_cookies)
+    
+    def buy_items(self, item_name, cost, growth, count, additional_cps):
+        """
+            Buy count of an item at once, the first for cost and
+            each one growth times dearer than the one before
+            
+            Should do nothing if you cannot afford them all
+            """
+        if count <= 0:
+            return
+        if growth == 1.0:
+            total = cost * count
+        else:
+            total = cost * (growth ** count - 1.0) / (growth - 1.0)
+        if total <= self._current_cookies:
+            self._current_cookies -= total
+            self._current_cps += additional_cps * count
+            self._history.extend(self._current_time, item_name,
+                                 [cost * growth ** index for index in range(count)],
+                                 self._total_cookies)
 
 
 def simulate_clicker(build_info, duration, strategy):
@@ -119,13 +645,15 @@ def simulate_clicker(build_info, duration, strategy):
         object corresponding to the final state of the game.
         """
     
-    my_build_info = build_info.clone()
+    my_build_info = IndexedBuildInfo(build_info.clone())
     clicker = ClickerState()
+    # strategies get a live read-only view rather than a copy per call
+    history = clicker.get_history_view()
     
     while clicker.get_time() <= duration:
-        if strategy(clicker.get_cookies(), clicker.get_cps(), clicker.get_history(), duration - clicker.get_time(), my_build_info) == None:
+        if strategy(clicker.get_cookies(), clicker.get_cps(), history, duration - clicker.get_time(), my_build_info) == None:
             break
-        elif strategy(clicker.get_cookies(), clicker.get_cps(), clicker.get_history(), duration - clicker.get_time(), my_build_info) == 'Cursor':
+        elif strategy(clicker.get_cookies(), clicker.get_cps(), history, duration - clicker.get_time(), my_build_info) == 'Cursor':
             item = 'Cursor'
             cost = my_build_info.get_cost(item)
             time = clicker.time_until(cost)
@@ -140,7 +668,7 @@ def simulate_clicker(build_info, duration, strategy):
                     my_build_info.update_item(item)
         
         else:
-            item = strategy(clicker.get_cookies(), clicker.get_cps(), clicker.get_history(), duration - clicker.get_time(), my_build_info)
+            item = strategy(clicker.get_cookies(), clicker.get_cps(), history, duration - clicker.get_time(), my_build_info)
             cost = my_build_info.get_cost(item)
             time = clicker.time_until(cost)
             clicker.wait(time)
@@ -155,6 +683,64 @@ def simulate_clicker(build_info, duration, strategy):
     return clicker
 
 
+def affordable_count(cookies, cost, growth):
+    """
+        Number of items whose costs start at cost and grow by the
+        factor growth that can be bought one after another while
+        more than the next cost is left out of cookies
+        """
+    if cookies <= cost:
+        return 0
+    if growth <= 1.0:
+        return int(math.ceil(cookies / cost)) - 1
+    # the first n costs add up to cost * (growth ** n - 1) / (growth - 1)
+    return int(math.ceil(math.log(1.0 + cookies * (growth - 1.0) / cost) /
+                         math.log(growth))) - 1
+
+
+def simulate_clicker_fast(build_info, duration, strategy):
+    """
+        Function to run a Cookie Clicker game like simulate_clicker,
+        but asking the strategy once per purchase, passing it a
+        read-only view of the history and working out how many
+        more of the same item can be bought in closed form.
+        Returns the final ClickerState.
+        """
+    
+    my_build_info = IndexedBuildInfo(build_info.clone())
+    clicker = ClickerState()
+    history = clicker.get_history_view()
+    
+    while clicker.get_time() <= duration:
+        item = strategy(clicker.get_cookies(), clicker.get_cps(), history, duration - clicker.get_time(), my_build_info)
+        if item == None:
+            break
+        cost = my_build_info.get_cost(item)
+        time = clicker.time_until(cost)
+        if clicker.get_time() + time > duration:
+            break
+        clicker.wait(time)
+        clicker.buy_item(item, cost, my_build_info.get_cps(item))
+        my_build_info.update_item(item)
+        
+        # the cost growth is read off the item's update, and all but
+        # the last of the repeat purchases are certain, so they are
+        # paid for at once with the sum of their geometric costs
+        next_cost = my_build_info.get_cost(item)
+        growth = next_cost / cost
+        count = affordable_count(clicker.get_cookies(), next_cost, growth) - 1
+        if count > 0:
+            clicker.buy_items(item, next_cost, growth, count, my_build_info.get_cps(item))
+            my_build_info.update_item(item, count)
+        while clicker.get_cookies() > my_build_info.get_cost(item):
+            clicker.buy_item(item, my_build_info.get_cost(item), my_build_info.get_cps(item))
+            my_build_info.update_item(item)
+    
+    time_left = duration - clicker.get_time()
+    clicker.wait(time_left)
+    return clicker
+
+
 def strategy_cursor_broken(cookies, cps, history, time_left, build_info):
     """
         Always pick Cursor!
@@ -181,6 +767,12 @@ def strategy_cheap(cookies, cps, history, time_left, build_info):
     """
         Always buy the cheapest item you can afford in the time left.
         """
+    if isinstance(build_info, IndexedBuildInfo):
+        cheapest = build_info.cheapest()
+        if cheapest == None or (cheapest[0] - cookies) / cps > time_left:
+            return None
+        return cheapest[1]
+    
     items = build_info.build_items()
     #print items
     cheap = None
@@ -205,8 +797,23 @@ def strategy_expensive(cookies, cps, history, time_left, build_info):
     """
         Always buy the most expensive item you can afford in the time left.
         """
-    items = build_info.build_items()
     can_make = cookies + time_left * cps
+    if isinstance(build_info, IndexedBuildInfo):
+        cheapest = build_info.cheapest()
+        if cheapest == None or cheapest[0] > can_make:
+            return None
+        choice = build_info.most_expensive()
+        if choice[0] <= can_make:
+            return choice[1]
+        # otherwise only items costing strictly less than can_make
+        # qualify, and a tie at the cheapest cost goes to the item
+        # listed last
+        choice = build_info.most_expensive(can_make)
+        if choice == None or choice[0] == cheapest[0]:
+            return build_info.items_costing(cheapest[0])[-1]
+        return choice[1]
+    
+    items = build_info.build_items()
     cost = []
     for item in items:
         cost.append(build_info.get_cost(item))
@@ -229,11 +836,204 @@ def strategy_expensive(cookies, cps, history, time_left, build_info):
                 exp_item = item
         return exp_item
 
-def strategy_best(cookies, cps, history, time_left, build_info):
+def plan_value(cookies, cps, time_left, items, counts, depth, candidates, seen):
     """
-        The best strategy that you are able to implement.
+        Most cookies that can be made in time_left by buying at
+        most depth more items, each from the candidates with the
+        shortest payback time, then waiting.  items holds (cost,
+        added cps, growth) triples, counts the items bought so far
+        in the plan.  Returns (cookies made, first item index).
         """
-    return None
+    best = (cps * time_left, None)
+    if depth == 0:
+        return best
+    
+    # a state with the same purchases reached with no more time
+    # left and no more cookies cannot do better
+    previous = seen.get(counts)
+    if previous != None and previous[0] >= time_left and previous[1] >= cookies:
+        return best
+    seen[counts] = (time_left, cookies)
+    
+    ranked = []
+    for index in range(len(items)):
+        cost, added_cps, growth = items[index]
+        cost *= growth ** counts[index]
+        wait = 0.0
+        if cookies < cost:
+            wait = math.ceil((cost - cookies) / cps)
+        if wait <= time_left and added_cps > 0:
+            ranked.append((wait + cost / added_cps, index, cost, wait))
+    ranked.sort()
+    
+    for dummy, index, cost, wait in ranked[:candidates]:
+        next_counts = counts[:index] + (counts[index] + 1,) + counts[index + 1:]
+        made = plan_value(cookies + cps * wait - cost, cps + items[index][1],
+                          time_left - wait, items, next_counts, depth - 1,
+                          candidates, seen)[0]
+        made += cps * wait
+        if made > best[0]:
+            best = (made, index)
+    return best
+
+
+def strategy_best(cookies, cps, history, time_left, build_info,
+                  lookahead=BEST_LOOKAHEAD, candidates=BEST_CANDIDATES):
+    """
+        Plan the next lookahead purchases among the candidates
+        items with the shortest payback (time to afford plus cost
+        over added CPS) and return the first item of the plan that
+        makes the most cookies in the time left, or None if no
+        plan beats buying nothing.
+        """
+    names = build_info.build_items()
+    if not names:
+        return None
+    growth = cost_growth(build_info)
+    items = [(build_info.get_cost(name), build_info.get_cps(name), growth)
+             for name in names]
+    index = plan_value(cookies, cps, time_left, items, (0,) * len(items),
+                       lookahead, candidates, {})[1]
+    if index == None:
+        return None
+    return names[index]
+
+
+def benchmark_strategies(duration=SIM_TIME, strategies=None):
+    """
+        Run each (name, strategy) pair, by default cheap, expensive
+        and best, with simulate_clicker_fast.  Returns a list of
+        dictionaries of total cookies, purchases, strategy calls
+        and strategy seconds per call.
+        """
+    if strategies == None:
+        strategies = [("Cheap", strategy_cheap), ("Expensive", strategy_expensive),
+                      ("Best", strategy_best)]
+    results = []
+    for name, strategy in strategies:
+        calls = [0, 0.0]
+        def timed(cookies, cps, history, time_left, build_info):
+            """
+                strategy, counting calls and time spent
+                """
+            start = timer.time()
+            item = strategy(cookies, cps, history, time_left, build_info)
+            calls[0] += 1
+            calls[1] += timer.time() - start
+            return item
+        state = simulate_clicker_fast(provided.BuildInfo(), duration, timed)
+        results.append({'strategy': name, 'total_cookies': state.get_total_cookies(),
+                        'purchases': len(state.get_history()) - 1, 'calls': calls[0],
+                        'seconds_per_call': calls[1] / max(calls[0], 1)})
+    return results
+
+# strategies run by the tournament, by name
+STRATEGIES = {"Cursor": strategy_cursor_broken, "None": strategy_none,
+              "Cheap": strategy_cheap, "Expensive": strategy_expensive,
+              "Best": strategy_best}
+
+def register_strategy(name, strategy):
+    """
+        Add a strategy to the tournament under name, dropping the
+        cached results of any other strategy that had the name.
+        Register strategies before run_tournament starts its workers.
+        """
+    if STRATEGIES.get(name) is not strategy:
+        for key in [key for key in TOURNAMENT_CACHE if key[0] == name]:
+            del TOURNAMENT_CACHE[key]
+    STRATEGIES[name] = strategy
+
+def build_fingerprint(build_info):
+    """
+        Hashable summary of a BuildInfo: every item's cost and CPS
+        and the cost growth, so changed builds miss the cache
+        """
+    items = build_info.build_items()
+    fingerprint = tuple((item, build_info.get_cost(item), build_info.get_cps(item))
+                        for item in items)
+    return fingerprint + (cost_growth(build_info),)
+
+def _tournament_task(task):
+    """
+        Worker for run_tournament: play one strategy with its
+        parameters for duration.  Returns (total cookies,
+        purchases, seconds).
+        """
+    name, params, duration, build_info = task
+    strategy = STRATEGIES[name]
+    keywords = dict(params)
+    def play(cookies, cps, history, time_left, info):
+        """
+            strategy with the swept parameters
+            """
+        return strategy(cookies, cps, history, time_left, info, **keywords)
+    start = timer.time()
+    state = simulate_clicker_fast(build_info, duration, play)
+    seconds = timer.time() - start
+    return state.get_total_cookies(), len(state.get_history()) - 1, seconds
+
+def run_tournament(names=None, sweeps=None, durations=TOURNAMENT_DURATIONS,
+                   build_info=None, processes=None, cache=TOURNAMENT_CACHE):
+    """
+        Play every named strategy (all registered ones by default)
+        for every duration, once per parameter dictionary in
+        sweeps[name] (or once without parameters), over a process
+        pool; processes=0 plays them in this process.  Cells already
+        in cache are not played again.  Returns a list of result
+        dictionaries, one per cell.
+        """
+    if names == None:
+        names = sorted(STRATEGIES)
+    if sweeps == None:
+        sweeps = {}
+    if build_info == None:
+        build_info = provided.BuildInfo()
+    fingerprint = build_fingerprint(build_info)
+    
+    cells = []
+    for name in names:
+        for params in sweeps.get(name, [{}]):
+            for duration in durations:
+                cells.append((name, tuple(sorted(params.items())), duration))
+    missing = [cell for cell in cells
+               if (cell[0], cell[1], fingerprint, cell[2]) not in cache]
+    tasks = [(name, params, duration, build_info) for name, params, duration in missing]
+    
+    if tasks and processes != 0:
+        pool = multiprocessing.Pool(processes)
+        try:
+            played = pool.map(_tournament_task, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        played = [_tournament_task(task) for task in tasks]
+    for cell, result in zip(missing, played):
+        cache[(cell[0], cell[1], fingerprint, cell[2])] = result
+    
+    results = []
+    for name, params, duration in cells:
+        total, purchases, seconds = cache[(name, params, fingerprint, duration)]
+        results.append({'strategy': name, 'params': dict(params), 'duration': duration,
+                        'total_cookies': total, 'purchases': purchases,
+                        'seconds': seconds, 'cached': (name, params, duration) not in missing})
+    return results
+
+def format_tournament(results):
+    """
+        Text table of run_tournament results, one line per cell,
+        best total cookies first within each duration
+        """
+    rows = [('strategy', 'params', 'duration', 'total cookies', 'purchases', 'seconds')]
+    for result in sorted(results, key=lambda result: (result['duration'], -result['total_cookies'])):
+        params = ', '.join('%s=%s' % item for item in sorted(result['params'].items()))
+        rows.append((result['strategy'], params, '%g' % result['duration'],
+                     '%g' % result['total_cookies'], str(result['purchases']),
+                     '%.4f' % result['seconds']))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return '\n'.join('  '.join(row[column].ljust(widths[column])
+                               for column in range(len(row))).rstrip()
+                     for row in rows)
 
 def run_strategy(strategy_name, time, strategy):
     """
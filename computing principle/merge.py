@@ -2,6 +2,22 @@
     Merge function for 2048 game.
     """
 
+import itertools
+import mmap
+import random
+import struct
+import time
+
+# results of merge_memo keyed by line tuple, emptied when full
+MERGE_CACHE = {}
+MERGE_CACHE_SIZE = 1 << 16
+
+# merge table file: header of magic, line length and largest tile
+# exponent, then for every line of exponents, ranked with the first
+# tile most significant, its merged exponents and uint32 score
+TABLE_MAGIC = "MRG1"
+TABLE_HEADER = "<4sHH"
+
 # get the none zero list to paire
 def get_none_zero_list(line):
     """
@@ -118,6 +134,204 @@ def merge(line):
         return none_zero_list + zero_list
 
 
+def merge_into(line, out):
+    """
+        Single pass merge of line into out, which may be line
+        itself. Returns the score gained and whether the line
+        changed.
+        """
+    length = len(line)
+    write = 0
+    pending = 0
+    score = 0
+    changed = False
+    # pending holds a tile waiting for its partner; every output
+    # cell is compared with the input before it is overwritten
+    for index in range(length):
+        value = line[index]
+        if value == 0:
+            continue
+        if pending == 0:
+            pending = value
+            continue
+        if pending == value:
+            value = 2 * pending
+            score += value
+            pending = 0
+        else:
+            value, pending = pending, value
+        changed = changed or line[write] != value
+        out[write] = value
+        write += 1
+    if pending:
+        changed = changed or line[write] != pending
+        out[write] = pending
+        write += 1
+    for index in range(write, length):
+        changed = changed or line[index] != 0
+        out[index] = 0
+    return score, changed
+
+
+def merge_memo(line):
+    """
+        merge_into with the results cached by the line's tuple.
+        Returns a (merged tuple, score, changed) triple.
+        """
+    key = tuple(line)
+    result = MERGE_CACHE.get(key)
+    if result == None:
+        if len(MERGE_CACHE) >= MERGE_CACHE_SIZE:
+            MERGE_CACHE.clear()
+        out = [0] * len(key)
+        score, changed = merge_into(key, out)
+        result = (tuple(out), score, changed)
+        MERGE_CACHE[key] = result
+    return result
+
+
+def build_merge_table(length, max_exponent):
+    """
+        Merged exponents and score of every line of length tiles
+        with exponents up to max_exponent, 0 being an empty cell.
+        Returns the packed table entries as a string.
+        """
+    assert max_exponent < 255, "merged exponents must fit in a byte"
+    entry = struct.Struct("<%dBI" % length)
+    values = [0] + [1 << exponent for exponent in range(1, max_exponent + 1)]
+    out = [0] * length
+    entries = []
+    for exponents in itertools.product(range(max_exponent + 1), repeat=length):
+        score = merge_into([values[exponent] for exponent in exponents], out)[0]
+        merged = [value.bit_length() - 1 if value else 0 for value in out]
+        merged.append(score)
+        entries.append(entry.pack(*merged))
+    return "".join(entries)
+
+
+def save_merge_table(path, length, max_exponent):
+    """
+        Build the merge table of lines of length tiles with
+        exponents up to max_exponent and write it to a file that
+        MergeTable can map.
+        """
+    out = open(path, "wb")
+    try:
+        out.write(struct.pack(TABLE_HEADER, TABLE_MAGIC, length, max_exponent))
+        out.write(build_merge_table(length, max_exponent))
+    finally:
+        out.close()
+
+
+class MergeTable:
+    """
+        Read-only merge table file, memory mapped so that loading
+        is immediate and processes share one copy.
+        """
+    
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._length, self._max_exponent = struct.unpack_from(
+            TABLE_HEADER, self._data, 0)
+        assert magic == TABLE_MAGIC, "not a merge table: " + path
+        self._entry = struct.Struct("<%dBI" % self._length)
+        self._start = struct.calcsize(TABLE_HEADER)
+        count = (self._max_exponent + 1) ** self._length
+        assert len(self._data) == self._start + count * self._entry.size, \
+            "truncated merge table: " + path
+        # exponent of each tile value the table covers
+        self._exponents = {0: 0}
+        for exponent in range(1, self._max_exponent + 1):
+            self._exponents[1 << exponent] = exponent
+    
+    def get_length(self):
+        """
+            Line length the table was built for.
+            """
+        return self._length
+    
+    def get_max_exponent(self):
+        """
+            Largest tile exponent the table was built for.
+            """
+        return self._max_exponent
+    
+    def lookup(self, line):
+        """
+            (merged line, score) of line, or None when line has the
+            wrong length or tiles outside the table.
+            """
+        if len(line) != self._length:
+            return None
+        base = self._max_exponent + 1
+        rank = 0
+        for value in line:
+            exponent = self._exponents.get(value)
+            if exponent == None:
+                return None
+            rank = rank * base + exponent
+        entry = self._entry.unpack_from(self._data, self._start + rank * self._entry.size)
+        merged = [1 << exponent if exponent else 0 for exponent in entry[:-1]]
+        return merged, entry[-1]
+    
+    def close(self):
+        """
+            Unmap the table file.
+            """
+        self._data.close()
+        self._file.close()
+
+
+def merge_lookup(line, table):
+    """
+        merge through a MergeTable, falling back to merge for lines
+        the table does not cover.
+        """
+    result = table.lookup(line)
+    if result == None:
+        return merge(line)
+    return result[0]
+
+
+def benchmark_merge(lengths=(4, 8, 16, 32, 64, 128), lines=2000, seed=0,
+                    table=None):
+    """
+        Time merge, merge_into and merge_memo on the same random
+        lines of each length, checking that they agree, and
+        merge_lookup too when given a MergeTable. Returns a list of
+        dictionaries of seconds per line.
+        """
+    rng = random.Random(seed)
+    results = []
+    for length in lengths:
+        batch = [[rng.choice((0, 0, 2, 2, 4, 8)) for dummy in range(length)]
+                 for dummy in range(lines)]
+        result = {'length': length}
+        start = time.time()
+        expected = [merge(line) for line in batch]
+        result['merge'] = (time.time() - start) / lines
+        out = [0] * length
+        start = time.time()
+        for line, merged in zip(batch, expected):
+            merge_into(line, out)
+            assert out == merged, "merge_into disagrees with merge"
+        result['merge_into'] = (time.time() - start) / lines
+        MERGE_CACHE.clear()
+        start = time.time()
+        for line in batch + batch:
+            merge_memo(line)
+        result['merge_memo'] = (time.time() - start) / (2 * lines)
+        if table != None:
+            start = time.time()
+            for line, merged in zip(batch, expected):
+                assert merge_lookup(line, table) == merged, \
+                    "merge_lookup disagrees with merge"
+            result['merge_lookup'] = (time.time() - start) / lines
+        results.append(result)
+    return results
+
+
 print merge([4,4,8])
 print merge([0,0,0,0])
 print merge([2, 3, 4, 4])